@@ -0,0 +1,424 @@
+# formatted with ruff 0.6.4
+import os
+import sys
+import json
+import time
+import shlex
+import select
+import resource
+import importlib
+import traceback
+import subprocess
+import multiprocessing
+from contextlib import contextmanager
+from profiling import profiled
+
+
+@contextmanager
+def cd(newdir):
+    prevdir = os.getcwd()
+    os.chdir(os.path.expanduser(newdir))
+    try:
+        yield
+    finally:
+        os.chdir(prevdir)
+
+
+@contextmanager
+def runResources(
+    cores: "list[int]|None" = None,
+    nthreads: int = 0,
+    plumedKernel: "str|None" = None,
+):
+    """Pins the calculation to a set of cores and sets the number of threads it can use
+
+    If plumedKernel is given, the codes that load PLUMED at runtime will use that kernel.
+    The settings are inherited by the processes that are launched within the context
+    """
+    prevaffinity = None
+    prevenv = {}
+    if cores:
+        prevaffinity = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cores)
+    if nthreads > 0:
+        for var in ("OMP_NUM_THREADS", "PLUMED_NUM_THREADS"):
+            prevenv[var] = os.environ.get(var)
+            os.environ[var] = str(nthreads)
+    if plumedKernel is not None:
+        prevenv["PLUMED_KERNEL"] = os.environ.get("PLUMED_KERNEL")
+        os.environ["PLUMED_KERNEL"] = plumedKernel
+    try:
+        yield
+    finally:
+        if prevaffinity is not None:
+            os.sched_setaffinity(0, prevaffinity)
+        for var, val in prevenv.items():
+            if val is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = val
+
+
+def resourceSnapshot() -> dict:
+    """Collects the resources used so far by the processes launched by the harness"""
+    snapshot = {
+        "time": time.perf_counter(),
+        "rusage": resource.getrusage(resource.RUSAGE_CHILDREN),
+        "io": {},
+    }
+    # the I/O of the children is added to the one of the parent when they are waited for
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, val = line.split(":")
+                snapshot["io"][key] = int(val)
+    except OSError:
+        pass
+    return snapshot
+
+
+def resourceUsage(start: dict, end: dict) -> dict:
+    """Returns the resources that were used between two snapshots"""
+    usage = {
+        "wall": end["time"] - start["time"],
+        "user": end["rusage"].ru_utime - start["rusage"].ru_utime,
+        "sys": end["rusage"].ru_stime - start["rusage"].ru_stime,
+        # ru_maxrss is in kB and it is the peak of the largest child so far, that
+        # also counts the memory of the harness, measuredRunMD replaces it
+        "maxrss": 1024 * end["rusage"].ru_maxrss,
+        "read": None,
+        "written": None,
+    }
+    if "rchar" in end["io"] and "rchar" in start["io"]:
+        usage["read"] = end["io"]["rchar"] - start["io"]["rchar"]
+        usage["written"] = end["io"]["wchar"] - start["io"]["wchar"]
+    return usage
+
+
+# how often the memory of the processes of a calculation is read, in seconds
+RSS_POLL_INTERVAL = 0.05
+
+
+def descendants(root: int) -> "list[int]":
+    """Returns the processes that descend from root, reading their parents in /proc"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # the name of the command is in parentheses and can contain spaces
+                ppid = int(f.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found = []
+    pending = [root]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def peakRSS(pid: int) -> int:
+    """Returns the peak resident set size (VmHWM) of a running process, in bytes"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return 1024 * int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def measuredRunMD(
+    runner, params: dict, profile: "str|None" = None
+) -> "tuple[int|bool, dict|None]":
+    """
+    Calls runner.runMD in a forked child process, so that the resources of the
+    children of that process are the ones of this calculation only.
+    If profile is given, the child saves the profile of runMD in it.
+
+    The peak RSS is the largest VmHWM of the processes launched by runMD, read
+    while they run: the RSS of the children reported by getrusage would include
+    the memory of the harness, that they had before exec.  Processes that last
+    less than RSS_POLL_INTERVAL may be missed.
+
+    Returns the exit code of the calculation, or True if runMD raised, and the
+    resources it used
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        status = 1
+        try:
+            start = resourceSnapshot()
+            with profiled(profile):
+                mdExitCode = runner.runMD(params)
+            with os.fdopen(wfd, "w") as f:
+                json.dump([mdExitCode, resourceUsage(start, resourceSnapshot())], f)
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+    os.close(wfd)
+    peaks = {}
+    with os.fdopen(rfd, "r") as f:
+        while True:
+            ready, _, _ = select.select([f], [], [], RSS_POLL_INTERVAL)
+            for child in descendants(pid):
+                peaks[child] = max(peaks.get(child, 0), peakRSS(child))
+            if ready:
+                data = f.read()
+                break
+    os.waitpid(pid, 0)
+    if data == "":
+        return True, None
+    mdExitCode, usage = json.loads(data)
+    usage["maxrss"] = max(peaks.values(), default=0)
+    return mdExitCode, usage
+
+
+def executeStagedRun(job: dict) -> "tuple[int|bool, dict|None]":
+    """
+    Runs a calculation in the directory prepared by stageMDCalc (see runtests.py).
+
+    job is a dict with the keys name, code, wdir, runner, params, cores, nthreads
+    and plumedKernel, and optionally the file where runMD is profiled (profile).
+    Returns the exit code of the calculation and the resources it used
+    """
+    with cd(job["wdir"]):
+        # Now run the MD calculation on the cores and with the threads that we were given
+        with runResources(job["cores"], job["nthreads"], job["plumedKernel"]):
+            return measuredRunMD(job["runner"], job["params"], job.get("profile"))
+
+
+class LocalSerial:
+    """
+    Runs the calculations one after the other in this process.
+
+    Like the other backends, execute calls done(name, result) as soon as each
+    calculation is over
+    """
+
+    def execute(self, jobs: "list[dict]", done=None) -> dict:
+        results = {}
+        for job in jobs:
+            results[job["name"]] = executeStagedRun(job)
+            if done is not None:
+                done(job["name"], results[job["name"]])
+        return results
+
+
+# the jobs and the slot of each worker of LocalProcessPool, inherited with fork
+_poolJobs = []
+_poolSlot = 0
+
+
+def _initPoolSlot(slots) -> None:
+    global _poolSlot
+    _poolSlot = slots.get()
+
+
+def _runPoolJob(args: "tuple[int, int]") -> "tuple[int, tuple[int|bool, dict]]":
+    index, nslots = args
+    job = dict(_poolJobs[index])
+    if job["cores"]:
+        # each worker uses its share of the cores
+        ncores = len(job["cores"])
+        start = _poolSlot * ncores // nslots
+        end = (_poolSlot + 1) * ncores // nslots
+        job["cores"] = job["cores"][start:end] or job["cores"]
+    return index, executeStagedRun(job)
+
+
+class LocalProcessPool:
+    """
+    Runs the calculations at the same time in a pool of worker processes.
+
+    If the calculations are given a set of cores, each worker uses its own subset
+    """
+
+    def __init__(self, nworkers: int = 0) -> None:
+        self.nworkers = nworkers if nworkers > 0 else os.cpu_count()
+
+    def execute(self, jobs: "list[dict]", done=None) -> dict:
+        global _poolJobs
+        if len(jobs) == 0:
+            return {}
+        nworkers = min(self.nworkers, len(jobs))
+        ctx = multiprocessing.get_context("fork")
+        slots = ctx.Queue()
+        for slot in range(nworkers):
+            slots.put(slot)
+        _poolJobs = jobs
+        results = {}
+        with ctx.Pool(nworkers, initializer=_initPoolSlot, initargs=(slots,)) as pool:
+            for index, result in pool.imap_unordered(
+                _runPoolJob, [(i, nworkers) for i in range(len(jobs))]
+            ):
+                results[jobs[index]["name"]] = result
+                if done is not None:
+                    done(jobs[index]["name"], result)
+        _poolJobs = []
+        return {job["name"]: results[job["name"]] for job in jobs}
+
+
+def runStagedJob(jobfile: str) -> None:
+    """
+    The entry point of the jobs submitted by the Slurm backend.
+
+    It runs the calculation described in jobfile, in the current directory, and
+    writes its exit code in the file exitcode and the resources used in usage.json
+    """
+    with open(jobfile, "r") as f:
+        job = json.load(f)
+    job["wdir"] = os.getcwd()
+    # the cores are chosen by the scheduler
+    job["cores"] = None
+    job["runner"] = importlib.import_module(f"tests.{job['code']}").mdcode()
+    try:
+        mdExitCode, usage = executeStagedRun(job)
+    except Exception:
+        mdExitCode, usage = True, None
+        raise
+    finally:
+        with open("usage.json", "w") as f:
+            json.dump(usage, f)
+        with open("exitcode", "w") as f:
+            f.write(f"{int(mdExitCode)}\n")
+
+
+class Slurm:
+    """
+    Submits each calculation as a job to a SLURM-like batch scheduler and waits
+    for all of them to finish.
+
+    The commands used to submit and to list the jobs can be changed, so that other
+    schedulers with a compatible interface (or a local stand-in) can be used
+    """
+
+    def __init__(
+        self,
+        sbatch: str = "sbatch",
+        squeue: str = "squeue",
+        options: "list[str]" = [],
+        interval: float = 10.0,
+        python: str = sys.executable,
+    ) -> None:
+        self.sbatch = shlex.split(sbatch)
+        self.squeue = shlex.split(squeue)
+        self.options = options
+        self.interval = interval
+        self.python = python
+
+    def submit(self, job: dict) -> str:
+        with open(f"{job['wdir']}/job.json", "w") as f:
+            json.dump(
+                {
+                    key: job[key]
+                    for key in ("name", "code", "params", "nthreads", "plumedKernel")
+                },
+                f,
+            )
+        # the job imports the runner from the tests directory of the repository
+        repodir = os.path.dirname(os.path.abspath(__file__))
+        script = f"{job['wdir']}/job.sh"
+        with open(script, "w") as f:
+            f.write("#!/bin/bash\n")
+            f.write(f"#SBATCH --job-name=plumedtc_{job['name']}\n")
+            f.write(f"#SBATCH --output={job['wdir']}/slurm.out\n")
+            for option in self.options:
+                f.write(f"#SBATCH {option}\n")
+            f.write(f"cd {shlex.quote(job['wdir'])}\n")
+            f.write(
+                f"{shlex.quote(self.python)} -c 'import sys; "
+                f'sys.path.insert(0, "{repodir}"); '
+                "from backends import runStagedJob; "
+                'runStagedJob("job.json")\'\n'
+            )
+        out = subprocess.run(
+            self.sbatch + ["--parsable", script], capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            print(f"Cannot submit {job['name']}: {out.stderr.strip()}")
+            return ""
+        # with --parsable sbatch prints jobid[;cluster]
+        return out.stdout.strip().split(";")[0]
+
+    def running(self, jobids: "list[str]") -> "set[str]|None":
+        """Returns the jobs that are still queued or running, None if squeue failed"""
+        out = subprocess.run(
+            self.squeue + ["-h", "-o", "%i", "-j", ",".join(jobids)],
+            capture_output=True,
+            text=True,
+        )
+        if out.returncode != 0:
+            # the jobs that have finished long ago are unknown to squeue
+            if "Invalid job id" in out.stderr:
+                return set()
+            return None
+        return set(out.stdout.split())
+
+    def result(self, job: dict) -> "tuple[int|bool, dict|None]":
+        """Reads the exit code and the resources used by a job that is over"""
+        mdExitCode, usage = True, None
+        if os.path.exists(f"{job['wdir']}/exitcode"):
+            with open(f"{job['wdir']}/exitcode", "r") as f:
+                mdExitCode = int(f.read())
+            if os.path.exists(f"{job['wdir']}/usage.json"):
+                with open(f"{job['wdir']}/usage.json", "r") as f:
+                    usage = json.load(f)
+        return mdExitCode, usage
+
+    def execute(self, jobs: "list[dict]", done=None) -> dict:
+        jobids = {job["name"]: self.submit(job) for job in jobs}
+        pending = [job for job in jobs if jobids[job["name"]] != ""]
+        results = {name: (True, None) for name, jobid in jobids.items() if jobid == ""}
+        while len(pending) > 0:
+            time.sleep(self.interval)
+            running = self.running([jobids[job["name"]] for job in pending])
+            if running is None:
+                continue
+            for job in pending:
+                if jobids[job["name"]] not in running:
+                    results[job["name"]] = self.result(job)
+                    if done is not None:
+                        done(job["name"], results[job["name"]])
+            pending = [job for job in pending if job["name"] not in results]
+        return {job["name"]: results[job["name"]] for job in jobs}
+
+
+def makeBackend(spec: str):
+    """
+    Creates a backend from a string:
+    "serial", "pool" or "pool:<workers>", "slurm" or "slurm:<options>".
+
+    The options of slurm are passed to sbatch, apart from sbatch=<command>,
+    squeue=<command> and interval=<seconds> that set up the backend, e.g.
+    "slurm:squeue=./fake_squeue sbatch=./fake_sbatch --partition=debug"
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "serial":
+        return LocalSerial()
+    elif kind == "pool":
+        return LocalProcessPool(int(arg) if arg != "" else 0)
+    elif kind == "slurm":
+        settings = {}
+        options = []
+        for option in shlex.split(arg):
+            key, _, value = option.partition("=")
+            if key in ("sbatch", "squeue"):
+                settings[key] = value
+            elif key == "interval":
+                settings[key] = float(value)
+            else:
+                options.append(option)
+        return Slurm(options=options, **settings)
+    raise ValueError(f"unknown backend {spec}")
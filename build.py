@@ -1,8 +1,20 @@
 # formatted with ruff 0.6.4
 import yaml
 import os
+from statistics import median
 from datetime import date
 
+# the timings of the previous deployment of the website, see the workflow
+PREVIOUS_DEPLOY = "tmp/previous"
+# how many runs are kept in the timing history of each code
+HISTORY_LENGTH = 30
+# the runs needed before a slowdown can be detected
+HISTORY_MIN_RUNS = 5
+# a timing is a regression if it is larger than the median of the history by more
+# than this many (scaled) MADs and by more than this fraction of the median
+REGRESSION_MADS = 3.0
+REGRESSION_MIN_SLOWDOWN = 0.1
+
 
 def isTest(path) -> bool:
     """
@@ -104,12 +116,86 @@ def getTestBadge( compile_status, test_status, version, code ) :
         )
     return f" [![tested on {version}](https://img.shields.io/badge/{version}-{test_badge_color})](tests/{code}/testout_{version}.html)"
 
+
+def testOfRun(run: str) -> str:
+    """Returns the test a calculation belongs to, e.g. virial for virial2"""
+    test = run.rstrip("0123456789")
+    return "forces" if test == "refres" else test
+
+
+def timingsByTest(runs: dict) -> dict:
+    """Sums the wall times of the calculations of each test"""
+    tests = {}
+    for run, wall in runs.items():
+        test = f"test {testOfRun(run)}"
+        tests[test] = tests.get(test, 0.0) + float(wall)
+    return tests
+
+
+def updateTimingHistory(code: str, results: dict) -> list:
+    """
+    Adds the timings of the last tests of code to the history kept in the
+    previous deployment of the website and writes the history in the new one
+    """
+    history = []
+    previous = f"{PREVIOUS_DEPLOY}/tests/{code}/timing_history.yml"
+    if os.path.exists(previous):
+        with open(previous, "r") as stream:
+            history = yaml.load(stream, Loader=yaml.SafeLoader) or []
+    thedate = date.today().isoformat()
+    for version, result in results.items():
+        if "timings" not in result:
+            continue
+        timings = {run: float(wall) for run, wall in result["timings"].items()}
+        timings.update(timingsByTest(timings))
+        history.append({"date": thedate, "version": version, "timings": timings})
+    history = history[-HISTORY_LENGTH * max(1, len(results)) :]
+    with open(f"tmp/extract/tests/{code}/timing_history.yml", "w") as stream:
+        stream.write(yaml.dump(history, sort_keys=False))
+    return history
+
+
+def performanceRegressions(history: list, version: str) -> "dict|None":
+    """
+    Compares the last timings of version with the ones before them, with the
+    median and the median absolute deviation (MAD) of each run and test.
+
+    Returns the runs and tests that became slower, with their timing and median,
+    or None if the history is too short
+    """
+    entries = [entry for entry in history if entry["version"] == version]
+    if len(entries) < HISTORY_MIN_RUNS + 1:
+        return None
+    latest, past = entries[-1]["timings"], entries[:-1]
+    slower = {}
+    for name, wall in latest.items():
+        values = [entry["timings"][name] for entry in past if name in entry["timings"]]
+        if len(values) < HISTORY_MIN_RUNS:
+            continue
+        center = median(values)
+        # 1.4826 makes the MAD comparable to the standard deviation
+        mad = 1.4826 * median([abs(value - center) for value in values])
+        if wall > center + max(REGRESSION_MADS * mad, REGRESSION_MIN_SLOWDOWN * center):
+            slower[name] = {"wall": wall, "median": center}
+    return slower
+
+
+def getPerformanceBadge(slower: "dict|None", version, code):
+    if slower is None:
+        badge_color = "unavailable-blue.svg"
+    elif len(slower) == 0:
+        badge_color = "stable-green.svg"
+    else:
+        badge_color = "slower-red.svg"
+    return f" [![timings on {version}](https://img.shields.io/badge/{version}-{badge_color})](tests/{code}/testout_{version}.html)"
+
+
 def buildBrowsePage():
     print("Building browse page")
 
     table = """
-| Name of Program  | Short description | Compiles | Basic tests | Virial tests | Energy tests |
-|:-----------------|:------------------|:--------:|:-----------:|:------------:|:------------:|
+| Name of Program  | Short description | Compiles | Basic tests | Virial tests | Energy tests | Performance |
+|:-----------------|:------------------|:--------:|:-----------:|:------------:|:------------:|:-----------:|
 """
     testdirs = [d for d in os.listdir("tests") if isTest("tests/" + d)]
     testdirs = sorted(testdirs)
@@ -119,6 +205,7 @@ def buildBrowsePage():
         basic_badge = ""
         virial_badge = ""
         energy_badge = ""
+        performance_badge = ""
         print("processing " + code)
         with open(f"tmp/extract/tests/{code}/info.yml", "r") as stream:
             info = yaml.load(stream, Loader=yaml.BaseLoader)
@@ -126,6 +213,7 @@ def buildBrowsePage():
         # sorting the versions
         results = info["results"]
         tested = versionSort(results.keys())
+        history = updateTimingHistory(code, results)
 
         for version in tested:
             # building the compilation badge
@@ -148,7 +236,19 @@ def buildBrowsePage():
             virial_badge += getTestBadge( compile_status, results[version]["test_plumed"]["virial"], version, code )
             energy_badge += getTestBadge( compile_status, results[version]["test_plumed"]["energy"], version, code )
 
-        table += f"| [{code}]({info['link']}) | {info['description']} | {compile_badge} | {basic_badge} | {virial_badge} | {energy_badge} | \n"
+            # the timings are compared with the ones of the previous runs
+            slower = None
+            if "timings" in results[version]:
+                slower = performanceRegressions(history, version)
+            if slower:
+                print(f"{code} with {version} is slower than usual:")
+                for name, timing in slower.items():
+                    print(
+                        f"  {name}: {timing['wall']:.2f} s (median {timing['median']:.2f} s)"
+                    )
+            performance_badge += getPerformanceBadge(slower, version, code)
+
+        table += f"| [{code}]({info['link']}) | {info['description']} | {compile_badge} | {basic_badge} | {virial_badge} | {energy_badge} | {performance_badge} | \n"
 
     plumed_installation_script = """When the tests above are run PLUMED is built using the install plumed action.
 ```yaml
@@ -1,7 +1,16 @@
 # used ruff 0.6.4 to check and format this
 import shutil
 import importlib
-from runtests import buildTestPages, runTests, writeMDReport, writeTermReport
+from runtests import (
+    buildTestPages,
+    runTests,
+    writeMDReport,
+    writeTermReport,
+    parseCoreList,
+    parseKernelList,
+)
+from backends import makeBackend
+from profiling import cleanProfiles, profileDirectory, profileFile, profiled
 import click
 
 
@@ -19,8 +28,105 @@ import click
 )
 @click.option("--printJson", "printJson", is_flag=True, default=False)
 @click.option("--printMarkdown", "printMD", is_flag=True, default=False)
+@click.option(
+    "--threads",
+    "-t",
+    default=0,
+    help="The number of threads each MD calculation can use (0 lets the code decide).",
+)
+@click.option(
+    "--cores", default="", help='The cores to run the MD calculations on, e.g. "0-3,8".'
+)
+@click.option(
+    "--early-stop",
+    "earlyStop",
+    default=0.0,
+    help="Stop the virial and energy runs as soon as the result is known with this "
+    "confidence, e.g. 0.99 (0 runs all the steps).",
+)
+@click.option(
+    "--combine-runs",
+    "combineRuns",
+    is_flag=True,
+    default=False,
+    help="Print the energy in the run of the basic tests instead of in a separate run.",
+)
+@click.option(
+    "--dump-format",
+    "dumpFormat",
+    type=click.Choice(["xyz", "trr"]),
+    default="xyz",
+    help="The format of the positions dumped by PLUMED (trr needs PLUMED with xdrfile).",
+)
+@click.option(
+    "--kernel",
+    "kernels",
+    multiple=True,
+    help='A PLUMED kernel to load at runtime, as "label=path", can be repeated.',
+)
+@click.option(
+    "--backend",
+    default="serial",
+    help='How the calculations are run: "serial", "pool[:<workers>]" or '
+    '"slurm[:<sbatch options>]" (sbatch=<command> and squeue=<command> replace the '
+    "scheduler commands).",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Do not repeat the calculations that were completed by a previous attempt.",
+)
+@click.option(
+    "--ranks",
+    default="",
+    help='Repeat the basic and forces tests with these numbers of MPI ranks, e.g. "2,4".',
+)
+@click.option(
+    "--launcher",
+    default=None,
+    help='The MPI launcher, with {ranks} for the number of ranks (default "mpirun -np {ranks}").',
+)
+@click.option(
+    "--benchmark",
+    is_flag=True,
+    default=False,
+    help="Measure the cost of PLUMED (ns/day without PLUMED, with an empty input and "
+    "with typical collective variables).",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Profile the python code of the harness with cProfile (the .pstats files "
+    'are saved in "*prefix*tests/<code>/profile").',
+)
+@click.option(
+    "--profile-workers",
+    "profileWorkers",
+    is_flag=True,
+    default=False,
+    help="Profile also the processes that run the calculations (implies --profile).",
+)
 def localRun(
-    codedir: str, prefix: str, plumed: "list[str]", printJson: bool, printMD: bool
+    codedir: str,
+    prefix: str,
+    plumed: "list[str]",
+    printJson: bool,
+    printMD: bool,
+    threads: int,
+    cores: str,
+    earlyStop: float,
+    combineRuns: bool,
+    dumpFormat: str,
+    kernels: "list[str]",
+    backend: str,
+    resume: bool,
+    ranks: str,
+    launcher: "str|None",
+    benchmark: bool,
+    profile: bool,
+    profileWorkers: bool,
 ):
     """Simple local run CLI
 
@@ -33,6 +139,8 @@ def localRun(
 
     Before running this you may need to manually remove some directories in "*prefix*tests".
     An error message will be printed if the directory is not empty.
+    With --resume the calculations completed by a previous run are kept and the others
+    are run again.
     """
     code: str = codedir.split("/")[-1]
     # to run PATH must contain the dir to plumed and the one to the executable of your code
@@ -47,25 +155,68 @@ def localRun(
     myMDcode = importlib.import_module(codedir.replace("/", "."), "mdcode")
     # And create the class that interfaces with the MD code output
     runner = myMDcode.mdcode()
-    # Now run the tests
-    print("Running the tests on stable")
-    # execNameChanged=False because in my case I have compiled qe without changing its suffix
-    results = runTests(
-        code,
-        "stable",
-        runner,
-        prefix=prefix,
-        settingsFor_runMDCalc=dict(execNameChanged=False, makeArchive=False),
-    )
-    writeTermReport(code, "stable", results)
+    # With --kernel the same executable is tested with each kernel
+    versions = {"stable": {}}
+    if len(kernels) > 0:
+        versions = {
+            label: {"plumedKernel": kernel}
+            for label, kernel in parseKernelList(kernels).items()
+        }
+    profileDir = None
+    extraSettings = {}
+    profile = profile or profileWorkers
+    if profile:
+        profileDir = profileDirectory(f"{prefix}tests/{code}")
+        if profileWorkers:
+            extraSettings["profileDir"] = profileDir
+    allResults = {}
+    for version, kernelSettings in versions.items():
+        # Now run the tests
+        print(f"Running the tests on {version}")
+        if profileDir is not None:
+            cleanProfiles(profileDir, version)
+        # execNameChanged=False because in my case I have compiled qe without changing its suffix
+        with profiled(profileFile(profileDir, f"runTests_{version}")):
+            results = runTests(
+                code,
+                version,
+                runner,
+                prefix=prefix,
+                settingsFor_runMDCalc=dict(
+                    execNameChanged=False,
+                    makeArchive=False,
+                    nthreads=threads,
+                    cores=parseCoreList(cores),
+                    backend=makeBackend(backend),
+                    launcher=launcher,
+                    **extraSettings,
+                    **kernelSettings,
+                ),
+                earlyStop=earlyStop,
+                combineRuns=combineRuns,
+                dumpFormat=dumpFormat,
+                resume=resume,
+                mpiRanks=parseCoreList(ranks),
+                benchmark=benchmark,
+            )
+        if not profile:
+            writeTermReport(code, version, results)
+        allResults[version] = results
     if printMD:
         print("Preparing pages")
         # Engforces and engvir share the same procedure
         shutil.copy("templates/engforces.md", "templates/engvir.md")
         # buildTestPages(codedir, prefix, plumedToRun)
         # this usues > 50% of the time
-        buildTestPages("templates", f"{prefix}pages", plumedToRun, overwrite=False)
-        writeMDReport(code, "stable", results, prefix=prefix)
+        with profiled(profileFile(profileDir, "buildTestPages")):
+            buildTestPages("templates", f"{prefix}pages", plumedToRun, overwrite=False)
+        for version, results in allResults.items():
+            with profiled(profileFile(profileDir, f"writeMDReport_{version}")):
+                writeMDReport(code, version, results, prefix=prefix)
+    if profile:
+        # the reports are printed when all the steps have been profiled
+        for version, results in allResults.items():
+            writeTermReport(code, version, results, profileDir=profileDir)
 
 
 if __name__ == "__main__":
@@ -74,7 +225,8 @@ if __name__ == "__main__":
     except FileExistsError as e:
         print(e)
         print(
-            "Please remove (and backup, if you need it) this directory before running again"
+            "Please remove (and backup, if you need it) this directory before running again,"
+            " or use --resume"
         )
         exit(1)
     except Exception as e:
@@ -0,0 +1,315 @@
+# formatted with ruff 0.6.4
+import os
+import re
+import time
+import shlex
+import socket
+import struct
+import hashlib
+import numpy as np
+
+
+def plumedOutputFiles(plumedinput: str) -> "list[str]":
+    """Returns the names of the files that are written by a PLUMED input"""
+    return re.findall(r"\bFILE=(\S+)", plumedinput)
+
+
+# runs the codes with more than one MPI rank on the local node
+DEFAULT_LAUNCHER = "mpirun -np {ranks}"
+
+
+def launchCommand(cmd: "list[str]", mdparams: dict) -> "list[str]":
+    """
+    Prepends the MPI launcher to the command that runs the MD code, if the
+    calculation must be run with more than one rank.
+
+    The number of ranks is in mdparams["mpiranks"] and the launcher, with a
+    {ranks} placeholder, in mdparams["launcher"]
+    """
+    nranks = mdparams.get("mpiranks", 1)
+    if nranks <= 1:
+        return cmd
+    launcher = mdparams.get("launcher") or DEFAULT_LAUNCHER
+    return shlex.split(launcher.format(ranks=nranks)) + cmd
+
+
+def readPerformance(filename: str) -> "float|None":
+    """
+    Reads the ns/day from the last "Performance:" line of a log,
+    as written by GROMACS (md.log) and LAMMPS (with real or metal units)
+    """
+    performance = None
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        for line in f:
+            if line.startswith("Performance:"):
+                try:
+                    performance = float(line.split()[1])
+                except (IndexError, ValueError):
+                    pass
+    return performance
+
+
+def getFreePort() -> int:
+    """Asks the OS for a TCP port on localhost that is not in use"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def uniqueSocketName(rundir: str) -> str:
+    """
+    Returns a name for a UNIX-domain socket that is unique to a run directory.
+
+    The name is short because the full path of a socket cannot be longer than
+    about 100 characters and the codes usually add a prefix like /tmp/ipi_
+    """
+    dirhash = hashlib.md5(os.path.abspath(rundir).encode()).hexdigest()[:12]
+    return f"plumedtc_{os.getpid()}_{dirhash}"
+
+
+def waitForOutputs(
+    expected: dict,
+    *,
+    timeout: float = 60.0,
+    interval: float = 0.1,
+    settle: int = 3,
+) -> bool:
+    """
+    Waits until the output files of a calculation have been completely written.
+
+    This is needed for codes (like i-pi) that are still writing their output
+    when the process that we have launched has returned.
+
+    Args:
+        expected (dict): maps the name of each file to the number of lines
+            (excluding the ones starting with #) that the file must contain
+            when it is complete, or to None if this number is not known: then
+            the file is complete when its size stops changing.
+        timeout (float): the maximum time to wait in seconds.
+        interval (float): the time between two checks of the files in seconds.
+        settle (int): the number of consecutive checks in which the size of a
+            file must not change before the file is considered closed.
+
+    Returns:
+        bool: True if all the files are complete, False if the timeout expired.
+    """
+    # for each file: offset already read, lines counted, last size, checks unchanged
+    status = {fname: [0, 0, -1, 0] for fname in expected}
+    start = time.monotonic()
+    while True:
+        complete = True
+        for fname, nlines in expected.items():
+            st = status[fname]
+            if not os.path.exists(fname):
+                complete = False
+                continue
+            size = os.path.getsize(fname)
+            st[3] = st[3] + 1 if size == st[2] else 0
+            st[2] = size
+            if nlines is None:
+                # the file may be binary (e.g. a trr), so only its size is checked
+                if st[3] < settle:
+                    complete = False
+                continue
+            if size > st[0]:
+                with open(fname, "rb") as f:
+                    f.seek(st[0])
+                    chunk = f.read(size - st[0])
+                # only count the lines that have been completely written
+                lastnewline = chunk.rfind(b"\n")
+                if lastnewline >= 0:
+                    st[1] += sum(
+                        1
+                        for line in chunk[:lastnewline].split(b"\n")
+                        if not line.startswith(b"#")
+                    )
+                    st[0] += lastnewline + 1
+            if st[0] != size or st[3] < settle:
+                complete = False
+            elif nlines is not None and st[1] < nlines:
+                complete = False
+        if complete:
+            return True
+        if time.monotonic() - start > timeout:
+            for fname, nlines in expected.items():
+                if nlines is None:
+                    if status[fname][3] < settle:
+                        print(f"Output file {fname} is still being written")
+                    continue
+                print(
+                    f"Output file {fname} is not complete: "
+                    f"{status[fname][1]} lines found, {nlines} expected"
+                )
+            return False
+        time.sleep(interval)
+
+
+def readEdr(filename: str, terms: "list[str]") -> dict:
+    """
+    Reads the energy terms listed in terms from a GROMACS edr file.
+
+    The edr file is XDR encoded and is read directly, so there is no need to
+    run gmx energy and parse the xvg file that it produces.
+    Both single and double precision files can be read.
+
+    Args:
+        filename (str): the path to the edr file.
+        terms (list[str]): the names of the energy terms, e.g. "Potential".
+
+    Returns:
+        dict: the time and the value of each of the energy terms in every frame.
+    """
+    with open(filename, "rb") as f:
+        buf = f.read()
+    pos = 0
+
+    def unpack(fmt):
+        nonlocal pos
+        vals = struct.unpack_from(">" + fmt, buf, pos)
+        pos += struct.calcsize(">" + fmt)
+        return vals
+
+    def skipString():
+        nonlocal pos
+        (nbytes,) = unpack("i")
+        pos += 4 * ((nbytes + 3) // 4)
+
+    # The names of the energy terms are at the start of the file
+    magic, file_version, nre = unpack("iii")
+    if magic != -55555:
+        raise ValueError(
+            f"{filename} is not an edr file (or it was written by GROMACS 3 or older)"
+        )
+    names = []
+    for _ in range(nre):
+        (nbytes,) = unpack("i")
+        names.append(buf[pos : pos + nbytes].decode("ascii"))
+        pos += 4 * ((nbytes + 3) // 4)
+        if file_version >= 2:
+            # the unit of the energy term
+            skipString()
+    indices = {}
+    for term in terms:
+        if term not in names:
+            raise ValueError(f"{filename} does not contain the energy term {term}")
+        indices[term] = names.index(term)
+
+    # the size in bytes of the blocks data types: int, float, double, int64, char
+    datasize = [4, 4, 8, 8, 4]
+    times, values = [], {term: [] for term in terms}
+    while pos < len(buf):
+        # the first real of the frame is used to find the precision of the file
+        double = struct.unpack_from(">i", buf, pos + 4)[0] != -7777777
+        real = "d" if double else "f"
+        unpack(real)
+        magic, frame_version = unpack("ii")
+        if magic != -7777777:
+            raise ValueError(f"{filename} contains an invalid energy frame")
+        (t,) = unpack("d")
+        _, nsum = unpack("qi")
+        if frame_version >= 3:
+            unpack("q")
+        if frame_version >= 5:
+            unpack("d")
+        nframeterms, ndisre, nblock = unpack("iii")
+        # each block is a list of (data type, number of elements)
+        blocks = []
+        if frame_version < 4:
+            realtype = 2 if double else 1
+            if ndisre > 0:
+                blocks.append([(realtype, ndisre), (realtype, ndisre)])
+            for _ in range(nblock):
+                (nr,) = unpack("i")
+                blocks.append([(realtype, nr)])
+        else:
+            for _ in range(nblock):
+                _, nsub = unpack("ii")
+                blocks.append([unpack("ii") for _ in range(nsub)])
+        # e_size and two reserved integers
+        unpack("iii")
+        # every energy term is followed by its average and sum if nsum>0
+        stride = 3 if nsum > 0 else 1
+        energies = np.frombuffer(
+            buf, dtype=">" + real, count=stride * nframeterms, offset=pos
+        )[::stride]
+        pos += energies.itemsize * stride * nframeterms
+        for sub in blocks:
+            for dtype, nr in sub:
+                if dtype == 5:
+                    # gmx_fio_ndo_string writes the length before each XDR string
+                    for _ in range(nr):
+                        unpack("i")
+                        skipString()
+                else:
+                    pos += datasize[dtype] * nr
+        # frames can contain only blocks and no energies
+        if nframeterms > 0:
+            times.append(t)
+            for term, index in indices.items():
+                values[term].append(energies[index])
+    data = {term: np.array(vals, dtype=np.float64) for term, vals in values.items()}
+    data["time"] = np.array(times)
+    return data
+
+
+# the cache of readColvar: filename -> (mtime, size, completeOnly, data)
+_colvarcache = {}
+
+
+def readColvar(filename: str, completeOnly: bool = False) -> dict:
+    """
+    Reads a file written by PLUMED (e.g. by PRINT) with a #! FIELDS header.
+
+    Args:
+        filename (str): the path to the file.
+        completeOnly (bool): set to True for files that are still being written,
+            to skip the last line if it is not complete.
+
+    Returns:
+        dict: the values in each column, with the names in the #! FIELDS line as keys.
+    """
+    stat = os.stat(filename)
+    if filename in _colvarcache:
+        mtime, size, complete, data = _colvarcache[filename]
+        if (
+            mtime == stat.st_mtime_ns
+            and size == stat.st_size
+            and complete == completeOnly
+        ):
+            return data
+    with open(filename, "r") as f:
+        text = f.read()
+    if completeOnly:
+        text = text[: text.rfind("\n") + 1]
+    fields = None
+    body = text
+    if text.startswith("#"):
+        # the header is at the top of the file, the body starts after the last #! line
+        lines = text.split("\n")
+        nheader = 0
+        while nheader < len(lines) and lines[nheader].startswith("#"):
+            if lines[nheader].startswith("#! FIELDS"):
+                fields = lines[nheader].split()[2:]
+            nheader += 1
+        body = "\n".join(lines[nheader:])
+    if fields is None:
+        raise ValueError(f"{filename} does not have a #! FIELDS line")
+    values = None
+    if "#" not in body:
+        values = np.fromstring(body, sep=" ")
+    if values is None or len(values) % len(fields) != 0:
+        # there are other comments (e.g. PLUMED was restarted) or missing columns
+        rows = [
+            line.split()
+            for line in body.split("\n")
+            if line.strip() != "" and not line.startswith("#")
+        ]
+        values = np.array(
+            [[float(x) for x in row] for row in rows if len(row) == len(fields)]
+        )
+    values = values.reshape(-1, len(fields))
+    data = {name: values[:, i] for i, name in enumerate(fields)}
+    _colvarcache[filename] = (stat.st_mtime_ns, stat.st_size, completeOnly, data)
+    return data
@@ -0,0 +1,230 @@
+# formatted with ruff 0.6.4
+import os
+import re
+import glob
+import atexit
+import zipfile
+import subprocess
+import multiprocessing
+from functools import lru_cache
+from PlumedToHTML import test_plumed
+
+
+@lru_cache(maxsize=None)
+def plumedVersion(executible: str) -> str:
+    """Returns the version of a PLUMED executable, asking it only once"""
+    return (
+        subprocess.check_output(f"{executible} info --version", shell=True)
+        .decode("utf-8")
+        .strip()
+    )
+
+
+def findKernel(executible: str) -> "str|None":
+    """Returns the path of the kernel library of a PLUMED executable, if it exists"""
+    try:
+        root = subprocess.check_output(
+            [executible, "--no-mpi", "info", "--root"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # the kernel is in the lib directory, next to the plumed root
+    name = os.path.basename(executible)
+    for ext in ("so", "dylib"):
+        kernel = f"{os.path.dirname(root)}/lib{name}Kernel.{ext}"
+        if os.path.exists(kernel):
+            return kernel
+    return None
+
+
+def readSettings(filename: str) -> "tuple[int, int]":
+    """Reads the number of replicas and of atoms from the #SETTINGS line of an input"""
+    nreplicas, natoms = 1, 100000
+    with open(filename) as ifile:
+        for line in ifile:
+            if "#SETTINGS" in line:
+                for word in line.split():
+                    if "NREPLICAS=" in word:
+                        nreplicas = int(word.replace("NREPLICAS=", ""))
+                    elif "NATOMS=" in word:
+                        natoms = int(word.replace("NATOMS=", ""))
+    return nreplicas, natoms
+
+
+def _validatorWorker(conn, kernel: str):
+    try:
+        import plumed
+
+        # this object keeps the kernel loaded for all the inputs that are checked
+        keeper = plumed.Plumed(kernel)
+    except Exception as e:
+        conn.send((-1, str(e)))
+        return
+    conn.send((0, ""))
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        folder, plumedfile, natoms, logfile = request
+        os.chdir(folder)
+        for bkpf in glob.glob("bck.*"):
+            if os.path.isfile(bkpf):
+                os.remove(bkpf)
+        # the same setup of plumed driver --parse-only
+        try:
+            with plumed.Plumed(kernel) as p:
+                p.cmd("setNatoms", natoms)
+                p.cmd("setMDEngine", "driver")
+                p.cmd("setTimestep", 1.0)
+                p.cmd("setKbT", 2.49)
+                p.cmd("setLogFile", logfile)
+                p.cmd("setPlumedDat", plumedfile)
+                p.cmd("init")
+            conn.send((0, ""))
+        except Exception as e:
+            conn.send((1, f"{type(e).__name__}: {e}\n"))
+    keeper.finalize()
+
+
+class PlumedValidator:
+    """Checks PLUMED inputs with a kernel that stays loaded in a worker process"""
+
+    def __init__(self, executible: str, kernel: str) -> None:
+        self.executible = executible
+        self.kernel = kernel
+        self.conn = None
+        self.proc = None
+
+    def start(self) -> bool:
+        self.conn, child = multiprocessing.get_context("fork").Pipe()
+        self.proc = multiprocessing.get_context("fork").Process(
+            target=_validatorWorker, args=(child, self.kernel), daemon=True
+        )
+        self.proc.start()
+        try:
+            status, message = self.conn.recv()
+        except EOFError:
+            status, message = -1, "the worker died while loading the kernel"
+        if status != 0:
+            print(f"Cannot load {self.kernel} in process: {message}")
+            self.close()
+            return False
+        return True
+
+    def close(self) -> None:
+        if self.proc is not None and self.proc.is_alive():
+            try:
+                self.conn.send(None)
+                self.proc.join(5)
+            except BrokenPipeError:
+                pass
+        if self.proc is not None and self.proc.is_alive():
+            self.proc.kill()
+        self.proc = None
+
+    def test(self, filename: str, natoms: int) -> "int|None":
+        """
+        Parses the input like test_plumed does and writes the same output files.
+        Returns None if the input could not be checked (e.g. the kernel crashed)
+        """
+        if self.proc is None and not self.start():
+            return None
+        outfile = filename + "." + self.executible + ".stdout.txt"
+        errtxtfile = filename + "." + self.executible + ".stderr.txt"
+        request = (
+            os.path.abspath(os.path.dirname(filename) or "."),
+            os.path.basename(filename),
+            natoms,
+            os.path.abspath(outfile),
+        )
+        try:
+            self.conn.send(request)
+            returnCode, error = self.conn.recv()
+        except (EOFError, BrokenPipeError):
+            # the worker is restarted for the next input
+            self.close()
+            return None
+        if not os.path.exists(outfile):
+            open(outfile, "w").close()
+        with open(errtxtfile, "w") as stderr:
+            stderr.write(error)
+        writeErrorPage(filename, self.executible)
+        return returnCode
+
+
+def _zip(path: str) -> None:
+    with zipfile.ZipFile(path + ".zip", "w") as f_out:
+        f_out.write(path)
+    os.remove(path)
+
+
+def writeErrorPage(filename: str, executible: str, header: str = "") -> None:
+    """
+    Writes the markdown page with the stderr and zips the outputs.
+    PlumedToHTML does not expose this part of test_plumed, keep the two in sync
+    """
+    plumed_file = os.path.basename(filename)
+    outfile = filename + "." + executible + ".stdout.txt"
+    errtxtfile = filename + "." + executible + ".stderr.txt"
+    errfile = filename + "." + executible + ".stderr.md"
+    with open(errfile, "w") as stderr, open(errtxtfile, "r") as stdtxterr:
+        if len(header) > 0:
+            print(header, file=stderr)
+        print("Stderr for source: ", re.sub("^data/", "", filename), "  ", file=stderr)
+        print(
+            f"Download: [zipped raw stdout]({plumed_file}.{executible}.stdout.txt.zip)"
+            f" - [zipped raw stderr]({plumed_file}.{executible}.stderr.txt.zip) ",
+            file=stderr,
+        )
+        print('{% raw %}\n<pre style="overflow:scroll;">', file=stderr)
+        print(
+            "#! Only the first 1000 rows of the error file are shown below", file=stderr
+        )
+        print(
+            "#! To inspect the full error file, please download the zipped raw stderr file above",
+            file=stderr,
+        )
+        for lc, line in enumerate(stdtxterr):
+            if lc >= 1000:
+                break
+            print(line.strip(), file=stderr)
+        print("</pre>\n{% endraw %}", file=stderr)
+    _zip(outfile)
+    _zip(errtxtfile)
+
+
+_validators = {}
+
+
+@atexit.register
+def closeValidators() -> None:
+    for validator in _validators.values():
+        if validator is not None:
+            validator.close()
+
+
+def validatePlumedInput(executible: str, filename: str, printjson: bool = False) -> int:
+    """
+    Checks if PLUMED can parse an input file, like test_plumed.
+
+    The input is parsed with the python interface of PLUMED, in a worker process
+    that keeps the kernel of the executable loaded, so that no process is started
+    and no library is loaded for each input.
+    test_plumed is used when this is not possible: if the python module or the
+    kernel are not available, if the input needs replicas or if the json files
+    with the expansions of the shortcuts are requested.
+    """
+    nreplicas, natoms = readSettings(filename)
+    if not printjson and nreplicas == 1:
+        if executible not in _validators:
+            kernel = findKernel(executible)
+            _validators[executible] = None
+            if kernel is not None:
+                validator = PlumedValidator(executible, kernel)
+                if validator.start():
+                    _validators[executible] = validator
+        if _validators[executible] is not None:
+            returnCode = _validators[executible].test(filename, natoms)
+            if returnCode is not None:
+                return returnCode
+    return test_plumed(executible, filename, printjson=printjson)
@@ -0,0 +1,96 @@
+# formatted with ruff 0.6.4
+import os
+import glob
+import pstats
+import cProfile
+from contextlib import contextmanager
+
+# how many functions are listed for each step of the harness
+PROFILE_TOP = 15
+
+# the profilers enabled by profiled, with the process that enabled them
+_active = []
+
+
+def profileDirectory(outdir: str) -> str:
+    """Returns the directory where the profiles of the harness are saved"""
+    directory = f"{outdir}/profile"
+    os.makedirs(directory, exist_ok=True)
+    return os.path.abspath(directory)
+
+
+def cleanProfiles(directory: str, version: str) -> None:
+    """Removes the profiles of a previous run of the tests of version"""
+    for filename in glob.glob(f"{directory}/*_{version}.pstats"):
+        os.remove(filename)
+
+
+def profileFile(directory: "str|None", step: str) -> "str|None":
+    """Returns the file where the profile of a step is saved, None if not profiling"""
+    if directory is None:
+        return None
+    return f"{directory}/{step}.pstats"
+
+
+@contextmanager
+def profiled(filename: "str|None"):
+    """Profiles the python code run within the context and saves it in filename
+
+    If filename is None nothing is done
+    """
+    if filename is None:
+        yield
+        return
+    # a forked worker inherits the profiler of the harness, and only one can be active
+    if len(_active) > 0 and _active[-1][0] != os.getpid():
+        _active[-1][1].disable()
+    profiler = cProfile.Profile()
+    _active.append((os.getpid(), profiler))
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _active.pop()
+        profiler.dump_stats(filename)
+
+
+def topCumulative(filenames: "list[str]", top: int = PROFILE_TOP) -> "list[dict]":
+    """Returns the functions with the largest cumulative time in the profiles"""
+    stats = pstats.Stats(*filenames)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    rows = []
+    for func in stats.fcn_list[:top]:
+        _, ncalls, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        where = (
+            name if filename == "~" else f"{os.path.basename(filename)}:{line}({name})"
+        )
+        rows.append(
+            {
+                "function": where,
+                "ncalls": ncalls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+        )
+    return rows
+
+
+def profileSummary(directory: str, version: str, top: int = PROFILE_TOP) -> dict:
+    """
+    Returns the top functions of each profiled step of the tests of version.
+
+    The profiles of the calculations (worker_*) are merged
+    """
+    summary = {}
+    workers = []
+    for filename in sorted(glob.glob(f"{directory}/*.pstats")):
+        step = os.path.basename(filename)[: -len(".pstats")]
+        if step.startswith("worker_") and step.endswith(f"_{version}"):
+            workers.append(filename)
+        elif step == "buildTestPages" or step.endswith(f"_{version}"):
+            summary[step] = topCumulative([filename], top)
+    if len(workers) > 0:
+        summary["the calculations"] = topCumulative(workers, top)
+    return summary
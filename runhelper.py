@@ -1,4 +1,5 @@
 from typing import Literal
+from statistics import NormalDist
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
@@ -45,6 +46,10 @@ TEST_DESCRIPTIONS = {
 
 SUCCESS = 5
 PARTIAL = 20
+# the minimum number of frames with a perturbation needed to stop the calculations early
+EARLY_STOP_MIN_FRAMES = 20
+# the blocks of frames used to estimate the error are never less than this
+EARLY_STOP_MIN_BLOCKS = 4
 
 
 def successState(success: int) -> Literal["broken", "success", "partial", "failure"]:
@@ -160,7 +165,18 @@ def figure_engforces(ax, xmd, xpl, xmd_xmdp):
 
 
 def writeReportPage(
-    filen, code, version, md_fail, zipfiles, ref, data, denom, *, prefix="", extra={}
+    filen,
+    code,
+    version,
+    md_fail,
+    zipfiles,
+    ref,
+    data,
+    denom,
+    *,
+    prefix="",
+    extra={},
+    comparison=None,
 ):
     with_image = False
     output = {
@@ -205,24 +221,17 @@ def writeReportPage(
         )
 
     else:
-        if len(zipfiles) == 1:
-            col1 = "MD code output"
-            col2 = "PLUMED output"
-            col3 = "Tolerance"
-        else:
-            col1 = "Original"
-            col2 = "With PLUMED"
-            col3 = "Effect of peturbation"
+        col1, col2, col3 = comparisonColumns(zipfiles)
         output["Results"] = f"| {col1} | {col2} | {col3} | % Difference | \n"
         output["Results"] += (
             "|:-------------|:--------------|:--------------|:--------------| \n"
         )
+        if comparison is None:
+            comparison = compareData(ref, data, denom)
+        percent_diff = comparison["percent_diff"]
         if hasattr(data, "__len__"):
             # then I would like to set up an image
             nlines = min(20, len(ref))
-            percent_diff = 100 * np.divide(
-                np.abs(ref - data), denom, out=np.zeros_like(denom), where=denom != 0
-            )
             if hasattr(ref[0], "__len__"):
                 if filen == "cell":
                     with_image = True
@@ -280,10 +289,27 @@ def writeReportPage(
                         f"| {ref[i]} | {data[i]} | {denom[i]} | {percent_diff[i]} |\n"
                     )
 
+            output["Results"] += comparisonSummary(comparison, col1, col2)
         else:
-            output["Results"] += (
-                f"| {ref} | {data} | {denom} | {100 * np.abs(ref - data) / denom} | \n"
+            output["Results"] += f"| {ref} | {data} | {denom} | {percent_diff} | \n"
+    if extra.get("atomorder") is not None and not md_fail:
+        atomOrder = extra["atomorder"]
+        moved = np.flatnonzero(atomOrder != np.arange(len(atomOrder)))
+        output["Results"] += (
+            f"\nThe atoms of the MD code were paired with those of PLUMED by position:"
+            f" {len(moved)} of {len(atomOrder)} atoms were reordered"
+        )
+        if len(moved) > 0:
+            output["Results"] += " (MD code atom → PLUMED atom: " + ", ".join(
+                f"{atomOrder[i]} → {i}" for i in moved[:20]
             )
+            output["Results"] += ", ...)" if len(moved) > 20 else ")"
+        output["Results"] += "\n"
+    if extra.get("minimumimage") and not md_fail:
+        output["Results"] += (
+            "\nThe positions of PLUMED are those of the periodic images of the atoms"
+            " that are the closest to the atoms of the MD code\n"
+        )
     if "sqrtalpha" in extra:
         output["sqrtalpha"] = extra["sqrtalpha"]
     # Read in the file template
@@ -298,27 +324,240 @@ def writeReportPage(
             of.write(f"![{filen}_{version}](./{filen}_{version}.png)\n")
 
 
+def comparable(
+    md_failed: "int|bool",
+    ref: "float|np.ndarray",
+    data: "float|np.ndarray",
+    denom: "float|np.ndarray",
+) -> bool:
+    """Returns True if the data of a test can be compared with the reference"""
+    if md_failed:
+        return False
+    if hasattr(data, "__len__") and len(ref) != len(data):
+        return False
+    if hasattr(data, "__len__") and len(denom) != len(data):
+        return False
+    return True
+
+
+def comparisonColumns(zipfiles: "list[str]") -> "tuple[str, str, str]":
+    """The labels of the two data that are compared and of the denominator"""
+    if len(zipfiles) == 1:
+        return "MD code output", "PLUMED output", "Tolerance"
+    return "Original", "With PLUMED", "Effect of peturbation"
+
+
+def comparisonSummary(comparison: dict, col1: str, col2: str) -> str:
+    """Describes in markdown where the differences of a test are the largest"""
+    summary = (
+        f"\n% Difference: mean {comparison['mean']:.4f},"
+        f" maximum {comparison['max']:.4f}, RMS {comparison['rms']:.4f}\n"
+    )
+    if comparison["perframe"] is not None and len(comparison["perframe"]) > 1:
+        frame = int(np.argmax(comparison["perframe"]))
+        summary += (
+            f"\nThe largest mean difference is in frame {frame}:"
+            f" {comparison['perframe'][frame]:.4f}%\n"
+        )
+    if comparison["peratom"] is not None:
+        atom = int(np.argmax(comparison["peratom"]))
+        summary += (
+            f"\nThe largest mean difference is on atom {atom}:"
+            f" {comparison['peratom'][atom]:.4f}%\n"
+        )
+    if len(comparison["worst"]) > 0:
+        summary += f"\n| Element | {col1} | {col2} | % Difference |\n"
+        summary += "|:--------|:--------|:--------|:--------|\n"
+        for element in comparison["worst"]:
+            if "atom" in element:
+                where = f"frame {element['frame']}, atom {element['atom']}"
+                where += "".join(f", component {i}" for i in element["index"][1:])
+            else:
+                where = ", ".join(str(i) for i in element["index"])
+            summary += (
+                f"| {where} | {element['ref']:.4f} | {element['data']:.4f}"
+                f" | {element['percent_diff']:.4f} |\n"
+            )
+    return summary
+
+
 def check(
     md_failed: "int|bool",
     ref: "float|np.ndarray",
     data: "float|np.ndarray",
     denom: "float|np.ndarray",
     denominatorTolerance: float = 0.0,
+    *,
+    comparison: "dict|None" = None,
 ) -> int:
     # this may be part of writeReportForSimulations
-    if md_failed:
-        return -1
-    if hasattr(data, "__len__") and len(ref) != len(data):
+    if not comparable(md_failed, ref, data, denom):
         return -1
-    if hasattr(data, "__len__") and len(denom) != len(data):
-        return -1
-    percent_diff = 100 * np.divide(
+    # the comparison may have been done already by the caller
+    if comparison is None:
+        comparison = compareData(ref, data, denom, denominatorTolerance)
+    return int(np.round(comparison["mean"]))
+
+
+def compareData(
+    ref: "float|np.ndarray",
+    data: "float|np.ndarray",
+    denom: "float|np.ndarray",
+    denominatorTolerance: float = 0.0,
+    *,
+    natoms: "int|None" = None,
+    topk: int = 5,
+) -> dict:
+    """
+    Compares the data of a test with the reference, element by element.
+
+    Returns the percent difference of each element and its mean, maximum and
+    RMS, the mean difference of each frame and, if the rows of the data are
+    natoms atoms for each frame, of each atom, and the topk worst elements.
+    The first axis of the data is the frames, unless natoms is given.
+
+    The mean is the one used by earlyDecision: the elements whose denominator
+    is not above denominatorTolerance are left out.
+    """
+    percent_diff = percentDifference(ref, data, denom, denominatorTolerance)
+    signal = np.broadcast_to(
+        np.asarray(denom) > denominatorTolerance, np.shape(percent_diff)
+    )
+    if np.ndim(percent_diff) == 0:
+        mean = float(percent_diff)
+    else:
+        nframes = len(percent_diff)
+        if natoms and nframes % natoms == 0:
+            nframes //= natoms
+        perframe = signalAverage(np.reshape(percent_diff, (nframes, -1)), signal)
+        mean = float(np.mean(perframe)) if len(perframe) > 0 else 0.0
+    comparison = {
+        "percent_diff": percent_diff,
+        "mean": mean,
+        "max": float(np.max(percent_diff, initial=0.0)),
+        "rms": float(np.sqrt(np.mean(np.square(percent_diff)))),
+        "perframe": None,
+        "peratom": None,
+        "worst": [],
+    }
+    if np.ndim(percent_diff) == 0 or np.size(percent_diff) == 0:
+        return comparison
+    rows = np.reshape(percent_diff, (len(percent_diff), -1))
+    if natoms and len(rows) % natoms == 0:
+        framed = np.reshape(rows, (-1, natoms, rows.shape[1]))
+        comparison["perframe"] = framed.mean(axis=(1, 2))
+        comparison["peratom"] = framed.mean(axis=(0, 2))
+    else:
+        comparison["perframe"] = rows.mean(axis=1)
+    # the largest elements, without sorting all of them
+    flat = np.ravel(percent_diff)
+    k = min(topk, flat.size)
+    worst = np.argpartition(flat, flat.size - k)[flat.size - k :]
+    worst = worst[np.argsort(flat[worst])[::-1]]
+    refflat = np.ravel(np.broadcast_to(ref, np.shape(percent_diff)))
+    dataflat = np.ravel(np.broadcast_to(data, np.shape(percent_diff)))
+    for i in worst:
+        if flat[i] == 0:
+            break
+        index = np.unravel_index(i, np.shape(percent_diff))
+        element = {
+            "index": tuple(int(j) for j in index),
+            "percent_diff": float(flat[i]),
+            "ref": float(refflat[i]),
+            "data": float(dataflat[i]),
+        }
+        if natoms and comparison["peratom"] is not None:
+            element["frame"], element["atom"] = divmod(int(index[0]), natoms)
+        comparison["worst"].append(element)
+    return comparison
+
+
+def percentDifference(
+    ref: "float|np.ndarray",
+    data: "float|np.ndarray",
+    denom: "float|np.ndarray",
+    denominatorTolerance: float = 0.0,
+) -> "float|np.ndarray":
+    # the difference is set to zero where the denominator is too small
+    denom = np.asarray(denom, dtype=float)
+    return 100 * np.divide(
         np.abs(ref - data),
         denom,
         out=np.zeros_like(denom),
         where=denom > denominatorTolerance,
     )
-    return int(np.round(np.average(percent_diff)))
+
+
+def blockStandardError(
+    series: np.ndarray, minblocks: int = EARLY_STOP_MIN_BLOCKS
+) -> float:
+    """
+    Returns the standard error of the mean of a time series, estimated with
+    block averaging (Flyvbjerg and Petersen) to account for the correlation
+    between consecutive frames: the largest estimate over the block sizes
+    that leave at least minblocks blocks is returned
+    """
+    blocks = np.asarray(series, dtype=float)
+    stderr = 0.0
+    while len(blocks) >= minblocks:
+        stderr = max(stderr, np.std(blocks, ddof=1) / np.sqrt(len(blocks)))
+        # the blocks are merged in pairs, dropping the last one if they are odd
+        half = len(blocks) // 2
+        blocks = 0.5 * (blocks[: 2 * half : 2] + blocks[1 : 2 * half : 2])
+    return stderr
+
+
+def signalAverage(percent_diff: np.ndarray, signal: np.ndarray) -> np.ndarray:
+    """
+    Returns, for each frame (row) of percent_diff with a signal, the average
+    difference over the elements with a signal
+    """
+    nframes = len(percent_diff)
+    percent_diff = np.reshape(percent_diff, (nframes, -1))
+    signal = np.reshape(signal, (nframes, -1))
+    counts = signal.sum(axis=1)
+    withsignal = counts > 0
+    return (percent_diff * signal).sum(axis=1)[withsignal] / counts[withsignal]
+
+
+def earlyDecision(
+    percent_diff: np.ndarray,
+    confidence: float,
+    minframes: int = EARLY_STOP_MIN_FRAMES,
+    signal: "np.ndarray|None" = None,
+) -> "Literal['success', 'partial', 'failure'] | None":
+    """
+    Decides the result of a test before the end of the simulations.
+
+    percent_diff contains the percent difference for each of the frames that
+    have been computed so far, and signal tells which of its elements have a
+    perturbation large enough to be compared (percentDifference sets the others
+    to zero).  Only the frames with a signal are used, and the result is
+    returned only if the confidence interval on their average difference lies
+    completely inside the range of one of the states returned by successState,
+    otherwise None is returned.  The average is the mean that compareData
+    gives to check at the end of the runs.
+    """
+    if signal is None:
+        signal = np.ones_like(percent_diff, dtype=bool)
+    perframe = signalAverage(percent_diff, signal)
+    if len(perframe) < minframes:
+        return None
+    stderr = blockStandardError(perframe)
+    # a constant difference is usually a sign that the runs are not diverged yet
+    if stderr == 0:
+        return None
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    low = np.mean(perframe) - z * stderr
+    high = np.mean(perframe) + z * stderr
+    # check rounds the average to an integer
+    if high < SUCCESS - 0.5:
+        return "success"
+    if low >= PARTIAL - 0.5:
+        return "failure"
+    if low >= SUCCESS - 0.5 and high < PARTIAL - 0.5:
+        return "partial"
+    return None
 
 
 class writeReportForSimulations:
@@ -350,6 +589,7 @@ class writeReportForSimulations:
         denom: "float|np.ndarray",
         *,
         denominatorTolerance: float = 0.0,
+        natoms: "int|None" = None,
     ) -> dict:
         report = {
             "filen": kind,
@@ -361,13 +601,21 @@ class writeReportForSimulations:
             "data": data,
             "denom": denom,
         }
+        # the same comparison is used for the badge and for the report page
+        comparison = None
+        if comparable(self.md_failed, ref, data, denom):
+            comparison = compareData(
+                ref, data, denom, denominatorTolerance, natoms=natoms
+            )
         failure_rate = check(
             self.md_failed,
             ref,
             data,
             denom,
             denominatorTolerance=denominatorTolerance,
+            comparison=comparison,
         )
+        report["comparison"] = comparison
         report["failure_rate"] = failure_rate
         report["docstring"] = TEST_DESCRIPTIONS[kind]
         return report
@@ -385,6 +633,7 @@ def dictToReport(input: dict, *, prefix: str = ""):
         "data": input["data"],
         "denom": input["denom"],
         "prefix": prefix,
+        "comparison": input.get("comparison"),
     }
     writeReportPage(**report, extra=input)
 
@@ -403,3 +652,68 @@ def dictToTestoutTableEntry(input: dict):
         )
         + " |\n"
     )
+
+
+def dictToUsageTable(usage: dict) -> str:
+    # one line for each MD calculation with the resources it used
+    table = (
+        "| Calculation | Wall time (s) | User CPU (s) | System CPU (s) "
+        "| Peak RSS (MB) | Read (MB) | Written (MB) |\n"
+        "|:------------|------:|------:|------:|------:|------:|------:|\n"
+    )
+    for name, use in usage.items():
+        read = "-" if use["read"] is None else f"{use['read'] / 2**20:.1f}"
+        written = "-" if use["written"] is None else f"{use['written'] / 2**20:.1f}"
+        table += (
+            f"| {name} | {use['wall']:.2f} | {use['user']:.2f} | {use['sys']:.2f} "
+            f"| {use['maxrss'] / 2**20:.1f} | {read} | {written} |\n"
+        )
+    return table
+
+
+def formatFailureRate(failure_rate: int) -> str:
+    return "brk" if failure_rate == -1 else f"{failure_rate}%"
+
+
+def dictToScalingTable(scaling: dict) -> str:
+    # one line for each number of MPI ranks, with the failure rate of each test
+    tests = list(next(iter(scaling.values()))["failure_rate"])
+    table = "| MPI ranks | Wall time (s) | Speedup | " + " | ".join(tests) + " |\n"
+    table += "|:----------|------:|------:|" + "------:|" * len(tests) + "\n"
+    reference = next(iter(scaling.values()))["wall"]
+    for nranks, entry in scaling.items():
+        speedup = "-"
+        if entry["wall"] > 0:
+            speedup = f"{reference / entry['wall']:.2f}"
+        rates = [formatFailureRate(entry["failure_rate"].get(t, -1)) for t in tests]
+        table += (
+            f"| {nranks} | {entry['wall']:.2f} | {speedup} | "
+            + " | ".join(rates)
+            + " |\n"
+        )
+    return table
+
+
+BENCHMARK_DESCRIPTIONS = {
+    "bench_noplumed": "Without PLUMED",
+    "bench_empty": "Empty PLUMED input",
+    "bench_cv": "Typical collective variables",
+}
+
+
+def dictToBenchmarkTable(benchmark: dict) -> str:
+    # one line for each benchmark calculation, with its speed and the cost of PLUMED
+    reference = BENCHMARK_DESCRIPTIONS[benchmark["reference"]]
+    table = "| Calculation | ns/day | Overhead | Measured from |\n"
+    table += "|:------------|------:|------:|:------|\n"
+    for name, run in benchmark["runs"].items():
+        table += (
+            f"| {BENCHMARK_DESCRIPTIONS[name]} | {run['nsday']:.3f} "
+            f"| {run['overhead']:.1f}% | {run['source']} |\n"
+        )
+    table += (
+        f"\nAll the calculations are {benchmark['nsteps']} steps long. "
+        f'The overhead is the extra time per step with respect to "{reference}". '
+        "The ns/day measured from the wall time include the start up of the code.\n"
+    )
+    return table
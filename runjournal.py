@@ -0,0 +1,69 @@
+# formatted with ruff 0.6.4
+import os
+import json
+import shutil
+import hashlib
+
+
+def paramsHash(params: dict) -> str:
+    """Returns a hash of the parameters of a calculation"""
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class RunJournal:
+    """
+    Records the calculations of a code and version that have been completed,
+    so that a sweep of tests that was interrupted can be resumed.
+
+    For each calculation the journal stores the hash of its parameters, its exit
+    code, the resources it used and the files that it left in its directory.
+    The journal is written again after each calculation.
+    """
+
+    def __init__(self, filename: str, resume: bool = False) -> None:
+        self.filename = filename
+        self.resume = resume
+        self.runs = {}
+        if resume and os.path.exists(filename):
+            with open(filename, "r") as f:
+                self.runs = json.load(f)
+
+    def completed(self, name: str, phash: str, wdir: str) -> "dict|None":
+        """
+        Returns the entry of a calculation that does not need to be run again.
+
+        When resuming, what is left of the calculations that cannot be reused
+        (interrupted, failed or run with other parameters) is removed
+        """
+        if not self.resume:
+            return None
+        entry = self.runs.get(name)
+        if (
+            entry is not None
+            and entry["hash"] == phash
+            and not entry["exitcode"]
+            and all(os.path.exists(f"{wdir}/{output}") for output in entry["outputs"])
+        ):
+            return entry
+        if os.path.isdir(wdir):
+            shutil.rmtree(wdir)
+        return None
+
+    def record(
+        self, name: str, phash: str, wdir: str, exitcode, usage: "dict|None" = None
+    ) -> None:
+        outputs = []
+        if os.path.isdir(wdir):
+            outputs = sorted(os.listdir(wdir))
+        self.runs[name] = {
+            "hash": phash,
+            "exitcode": int(exitcode),
+            "outputs": outputs,
+            "usage": usage,
+        }
+        # the journal is replaced in one go, so it is never left half written
+        tmpfile = f"{self.filename}.tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(self.runs, f, indent=1)
+        os.replace(tmpfile, self.filename)
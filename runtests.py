@@ -1,38 +1,80 @@
 # formatted with ruff 0.6.4
 import os
+import time
+import errno
 import yaml
 import shutil
+import signal
 import subprocess
+import multiprocessing
 import numpy as np
 from pathlib import Path
 from MDAnalysis.coordinates.XYZ import XYZReader
+from MDAnalysis.lib.formats.libmdaxdr import TRRFile
 from datetime import date
-from contextlib import contextmanager
-from PlumedToHTML import test_plumed, get_html
+from PlumedToHTML import get_html
+from plumedcheck import validatePlumedInput, plumedVersion
+from mdhelper import readColvar
+from backends import LocalSerial, makeBackend
+from runjournal import RunJournal, paramsHash
+from profiling import (
+    cleanProfiles,
+    profileDirectory,
+    profileFile,
+    profiled,
+    profileSummary,
+)
 from runhelper import (
     writeReportForSimulations,
+    comparisonColumns,
     dictToReport,
     dictToTestoutTableEntry,
+    dictToUsageTable,
+    dictToScalingTable,
+    dictToBenchmarkTable,
+    earlyDecision,
+    formatFailureRate,
+    percentDifference,
     successState,
     testOpinion,
 )
 from runhelper import BASIC_TEST_ORDER, VIRIAL_TEST_ORDER, ENERGY_TEST_ORDER 
 from typing import Literal
 
+try:
+    # only needed to match the atoms of the codes that reorder them
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# the names of the components of the cell printed with PRINT ARG=c.*
+CELL_FIELDS = [f"c.{v}{x}" for v in "abc" for x in "xyz"]
+
 STANDARD_RUN_SETTINGS = [
     {"plumed": "plumed", "printJson": False},
     {"plumed": "plumed_master", "printJson": True, "version": "master"},
 ]
 
 
-@contextmanager
-def cd(newdir):
-    prevdir = os.getcwd()
-    os.chdir(os.path.expanduser(newdir))
-    try:
-        yield
-    finally:
-        os.chdir(prevdir)
+def parseKernelList(kernels: "list[str]") -> dict:
+    """Converts a list like ["v2.9=/path/libplumedKernel.so"] into a dict label: path"""
+    kerneldict = {}
+    for item in kernels:
+        label, path = item.split("=", 1)
+        kerneldict[label] = path
+    return kerneldict
+
+
+def parseCoreList(cores: str) -> "list[int]":
+    """Converts a list of cores like "0-3,8" into a list of integers"""
+    corelist = []
+    for item in cores.split(","):
+        if "-" in item:
+            first, last = item.split("-")
+            corelist += list(range(int(first), int(last) + 1))
+        elif item != "":
+            corelist.append(int(item))
+    return corelist
 
 
 def yamlToDict(filename, **yamlOpts):
@@ -78,7 +120,7 @@ def processMarkdown(
             usejson = False
             for plmd in runSettings:
                 successes.append(
-                    test_plumed(
+                    validatePlumedInput(
                         plmd["plumed"], solutionfile, printjson=plmd["printJson"]
                     )
                 )
@@ -91,13 +133,7 @@ def processMarkdown(
                 if "version" in plmd:
                     versions.append(plmd["version"])
                 else:
-                    versions.append(
-                        subprocess.check_output(
-                            f"{plmd['plumed']} info --version", shell=True
-                        )
-                        .decode("utf-8")
-                        .strip()
-                    )
+                    versions.append(plumedVersion(plmd["plumed"]))
 
             # Use PlumedToHTML to create the input with all the bells and whistles
             html = get_html(
@@ -134,52 +170,456 @@ def buildTestPages(
             )
 
 
-def runMDCalc(
+def mdCalcDir(name: str, code: str, version: str, prefix: str = "") -> str:
+    """Returns the directory in which a calculation is run"""
+    wdir = f"tests/{code}/{name}_{version}"
+    if prefix != "":
+        wdir = f"{prefix}{wdir}"
+    return wdir
+
+
+def stageMDCalc(
     name: str,
     code: str,
     version: str,
-    runner,
     params: dict,
     *,
     executible: str,
     prefix: str = "",
     execNameChanged: bool = True,
-    makeArchive: bool = True,
-):
+    nthreads: int = 0,
+    execSuffix: "str|None" = None,
+    mpiranks: int = 1,
+    launcher: "str|None" = None,
+) -> "str|None":
+    """
+    Prepares the directory of a calculation and returns its path,
+    or None if the executable of the code does not exist
+    """
     # Get the name of the executible
     basedir = f"tests/{code}"
     params["executible"] = executible
+    if nthreads > 0:
+        params["nthreads"] = nthreads
+    if mpiranks > 1:
+        # the runners start the code with mdhelper.launchCommand
+        params["mpiranks"] = mpiranks
+        if launcher is not None:
+            params["launcher"] = launcher
     if execNameChanged:
-        params["executible"] += f"_{version}"
+        # when many kernels are tested with the same executable the suffix
+        # of the executable is not the version that is tested
+        params["executible"] += f"_{version}" if execSuffix is None else execSuffix
 
     print(f'Starting run "{name}"')
     # Now test that the executable exists if it doesn't then the test is broken
     if shutil.which(params["executible"]) is None:
         print(f"Executable {params['executible']} does not exist in current PATH.")
-        return True
+        return None
     # Copy all the input needed for the MD calculation
-    wdir = f"{basedir}/{name}_{version}"
-    if prefix != "":
-        wdir = f"{prefix}{wdir}"
+    wdir = mdCalcDir(name, code, version, prefix)
     shutil.copytree(f"{basedir}/input", f"{wdir}")
-    # Change to the directory to run the calculation
-    # print(f"{params=}")
-    with cd(f"{wdir}"):
-        # Output the plumed file
-        with open("plumed.dat", "w+") as of:
+    # Output the plumed file, unless the calculation is run without PLUMED
+    if params["plumed"] is not None:
+        with open(f"{wdir}/plumed.dat", "w+") as of:
             of.write(params["plumed"])
-        # Now run the MD calculation
-        mdExitCode = runner.runMD(params)
+    return wdir
+
+
+def finishMDCalc(wdir: str, makeArchive: bool = True) -> None:
     # Make a zip archive that contains the input and output
     if makeArchive:
         shutil.make_archive(f"{wdir}", "zip", f"{wdir}")
-    return mdExitCode
+
+
+def runMDCalcs(
+    jobs: dict,
+    code: str,
+    version: str,
+    runner,
+    *,
+    executible: str,
+    prefix: str = "",
+    execNameChanged: bool = True,
+    makeArchive: bool = True,
+    cores: "list[int]|None" = None,
+    nthreads: int = 0,
+    usage: "dict|None" = None,
+    plumedKernel: "str|None" = None,
+    execSuffix: "str|None" = None,
+    backend=None,
+    journal: "RunJournal|None" = None,
+    mpiranks: int = 1,
+    launcher: "str|None" = None,
+    profileDir: "str|None" = None,
+) -> dict:
+    """
+    Runs the calculations in jobs (name: params) with the backend (see backends.py),
+    all the calculations are staged before the first one is started.
+    The calculations are recorded in the journal, if given, and those that
+    were already completed are not repeated when resuming.
+    If profileDir is given, the local backends save a profile of the runMD
+    of each calculation in it.
+    Returns the exit code of each calculation, or True if it could not be run
+    """
+    staged = []
+    mdExitCodes = {}
+    hashes = {}
+    for name, params in jobs.items():
+        if journal is not None:
+            # the hash of the parameters chosen by the test, before they are completed
+            hashes[name] = paramsHash(params)
+            entry = journal.completed(
+                name, hashes[name], mdCalcDir(name, code, version, prefix)
+            )
+            if entry is not None:
+                print(f'Run "{name}" was completed before, it is not repeated')
+                mdExitCodes[name] = entry["exitcode"]
+                if usage is not None and entry["usage"] is not None:
+                    usage[name] = entry["usage"]
+                continue
+        wdir = stageMDCalc(
+            name,
+            code,
+            version,
+            params,
+            executible=executible,
+            prefix=prefix,
+            execNameChanged=execNameChanged,
+            nthreads=nthreads,
+            execSuffix=execSuffix,
+            mpiranks=mpiranks,
+            launcher=launcher,
+        )
+        if wdir is None:
+            mdExitCodes[name] = True
+            continue
+        staged.append(
+            {
+                "name": name,
+                "code": code,
+                "wdir": os.path.abspath(wdir),
+                "runner": runner,
+                "params": params,
+                "cores": cores,
+                "nthreads": nthreads,
+                "plumedKernel": plumedKernel,
+                # the calculations are profiled where they are run (see backends.py)
+                "profile": None
+                if profileDir is None
+                else f"{profileDir}/worker_{name}_{version}.pstats",
+            }
+        )
+    if backend is None:
+        backend = LocalSerial()
+    done = None
+    if journal is not None:
+        wdirs = {job["name"]: job["wdir"] for job in staged}
+
+        def done(name: str, result: tuple) -> None:
+            journal.record(name, hashes[name], wdirs[name], *result)
+
+    for name, (mdExitCode, mdusage) in backend.execute(staged, done).items():
+        mdExitCodes[name] = mdExitCode
+        # Store the resources used by the calculation
+        if usage is not None and mdusage is not None:
+            usage[name] = mdusage
+    for job in staged:
+        finishMDCalc(job["wdir"], makeArchive)
+    # the exit codes are returned in the same order of the jobs
+    return {name: mdExitCodes[name] for name in jobs}
+
+
+def runMDCalc(
+    name: str,
+    code: str,
+    version: str,
+    runner,
+    params: dict,
+    **runMDCalcSettings,
+):
+    """Runs a single calculation, see runMDCalcs for the settings"""
+    return runMDCalcs({name: params}, code, version, runner, **runMDCalcSettings)[name]
+
+
+def _runInProcessGroup(conn, name: str, params: dict, runMDCalcSettings: dict):
+    # a new process group, so that the MD code can be killed with all its children
+    os.setpgrp()
+    usage = {}
+    settings = dict(
+        runMDCalcSettings, usage=usage, makeArchive=False, backend=None, journal=None
+    )
+    conn.send((runMDCalc(name, params=params, **settings), usage.get(name)))
+
+
+def runConcurrentMDCalcs(
+    jobs: dict,
+    outdir: str,
+    runMDCalcSettings: dict,
+    *,
+    stopWhen=None,
+    interval: float = 1.0,
+) -> dict:
+    """
+    Runs the calculations in jobs (name: params) at the same time.
+
+    stopWhen is called while the calculations are running: when it returns True
+    all the calculations that are still running are killed and are considered
+    successful. If a calculation fails the others are killed and considered failed.
+    Returns the exit code of each calculation, like runMDCalc.
+    """
+    usage = runMDCalcSettings.get("usage")
+    journal = runMDCalcSettings.get("journal")
+    if journal is not None:
+        hashes = {name: paramsHash(params) for name, params in jobs.items()}
+        version = runMDCalcSettings["version"]
+        wdirs = {name: f"{outdir}/{name}_{version}" for name in jobs}
+        entries = {
+            name: journal.completed(name, hashes[name], wdirs[name]) for name in jobs
+        }
+        if all(entry is not None for entry in entries.values()):
+            print(f"Runs {', '.join(jobs)} were completed before, not repeating them")
+            for name, entry in entries.items():
+                if usage is not None and entry["usage"] is not None:
+                    usage[name] = entry["usage"]
+            return {name: entry["exitcode"] for name, entry in entries.items()}
+        # the calculations are stopped together, so they are all run again
+        if journal.resume:
+            for wdir in wdirs.values():
+                if os.path.isdir(wdir):
+                    shutil.rmtree(wdir)
+    for name in jobs:
+        # like stageMDCalc, which fails in the child process where nobody would see it
+        wdir = f"{outdir}/{name}_{runMDCalcSettings['version']}"
+        if os.path.exists(wdir):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), wdir)
+    ctx = multiprocessing.get_context("fork")
+    procs = {}
+    conns = {}
+    for name, params in jobs.items():
+        conns[name], send = ctx.Pipe(duplex=False)
+        procs[name] = ctx.Process(
+            target=_runInProcessGroup, args=(send, name, params, runMDCalcSettings)
+        )
+        procs[name].start()
+    mdruns = {}
+    while len(mdruns) < len(jobs):
+        for name, proc in procs.items():
+            if name in mdruns:
+                continue
+            if conns[name].poll():
+                mdruns[name], mdusage = conns[name].recv()
+                if usage is not None and mdusage is not None:
+                    usage[name] = mdusage
+            elif not proc.is_alive():
+                # the process died without telling us how the calculation went
+                mdruns[name] = True
+        if any(mdruns.values()) or (stopWhen is not None and stopWhen()):
+            break
+        time.sleep(interval)
+    failed = any(mdruns.values())
+    for name, proc in procs.items():
+        if name not in mdruns:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            mdruns[name] = failed
+        proc.join()
+    if journal is not None:
+        for name in jobs:
+            mdusage = usage.get(name) if usage is not None else None
+            journal.record(name, hashes[name], wdirs[name], mdruns[name], mdusage)
+    if runMDCalcSettings.get("makeArchive", True):
+        for name in jobs:
+            wdir = f"{outdir}/{name}_{runMDCalcSettings['version']}"
+            if os.path.isdir(wdir):
+                shutil.make_archive(wdir, "zip", wdir)
+    return mdruns
+
+
+def colvarFields(
+    filename: str, fields: "list[str]", completeOnly: bool = False
+) -> np.ndarray:
+    """
+    Returns the columns of a PLUMED output with the given names,
+    as a 1D array if only one name is given
+    """
+    data = readColvar(filename, completeOnly)
+    if len(fields) == 1:
+        return data[fields[0]]
+    return np.column_stack([data[name] for name in fields])
+
+
+def perturbationStopper(
+    outdir: str,
+    version: str,
+    title: str,
+    filename: str,
+    fields: "list[str]",
+    earlyStop: float,
+    denominatorTolerance: float,
+):
+    """
+    Returns a function to use as stopWhen in runConcurrentMDCalcs for the tests
+    that compare the runs {title}1, {title}2 and {title}3 and a dict that will
+    contain the number of frames that were used to take the decision.
+    """
+    files = [f"{outdir}/{title}{i}_{version}/{filename}" for i in (1, 2, 3)]
+    decision = {}
+
+    def stopWhen() -> bool:
+        try:
+            vals = [colvarFields(fname, fields, completeOnly=True) for fname in files]
+        except (OSError, ValueError):
+            # the files have not been created yet
+            return False
+        nframes = min(len(val) for val in vals)
+        if nframes == 0:
+            return False
+        val1, val2, val3 = [val[:nframes] for val in vals]
+        denom = np.abs(val1 - val3)
+        state = earlyDecision(
+            percentDifference(val1, val2, denom, denominatorTolerance),
+            earlyStop,
+            signal=denom > denominatorTolerance,
+        )
+        if state is None:
+            return False
+        print(f'Stopping the "{title}" runs after {nframes} frames: {state}')
+        decision["frames"] = nframes
+        decision["state"] = state
+        return True
+
+    return stopWhen, decision
+
+
+def dumpedAtomsFile(basicDir: str) -> "str|None":
+    """Returns the file with the atoms dumped by PLUMED in the basic run, if any"""
+    for ext in ("trr", "xyz"):
+        if os.path.exists(f"{basicDir}/plumed.{ext}"):
+            return f"{basicDir}/plumed.{ext}"
+    return None
+
+
+def readDumpedAtoms(
+    filename: str, maxframes: "int|None" = None
+) -> "tuple[np.ndarray, np.ndarray]":
+    """
+    Reads the atoms dumped by PLUMED with DUMPATOMS in a xyz or trr file.
+
+    Returns the number of atoms in each frame and the positions of all the frames,
+    one after the other
+    """
+    if filename.endswith(".trr"):
+        with TRRFile(filename) as trr:
+            nframes = len(trr) if maxframes is None else min(len(trr), maxframes)
+            positions = None
+            for i in range(nframes):
+                frame = trr.read()
+                if positions is None:
+                    positions = np.empty(
+                        (nframes,) + frame.x.shape, dtype=frame.x.dtype
+                    )
+                positions[i] = frame.x
+        if positions is None:
+            return np.empty(0, dtype=int), np.empty((0, 3))
+        return np.full(nframes, positions.shape[1]), positions.reshape(-1, 3)
+    plumedtraj = XYZReader(filename)
+    natoms = []
+    positions = []
+    for frame in plumedtraj.trajectory:
+        if maxframes is not None and len(natoms) == maxframes:
+            break
+        natoms.append(frame.positions.shape[0])
+        positions.append(frame.positions.copy())
+    if len(positions) == 0:
+        return np.empty(0, dtype=int), np.empty((0, 3))
+    return np.array(natoms), np.concatenate(positions, axis=0)
+
+
+def matchAtomOrder(
+    codepos: np.ndarray, plumedpos: np.ndarray, cell: "np.ndarray|None" = None
+) -> "np.ndarray|None":
+    """
+    Finds the order of the atoms of the MD code that matches the order of PLUMED,
+    by pairing each atom with the closest one in the PLUMED frame.
+
+    codepos and plumedpos are the positions of one frame, cell has the lattice
+    vectors as rows (the distances are periodic when it is not zero).
+    Returns the indices that sort the atoms of the code like those of PLUMED,
+    or None if the atoms cannot be paired one to one
+    """
+    if cKDTree is None:
+        print("scipy is needed to match the atoms of the MD code with those of PLUMED")
+        return None
+    if codepos.shape != plumedpos.shape:
+        return None
+    boxsize = None
+    if cell is not None and abs(np.linalg.det(cell)) > 0:
+        # in fractional coordinates every cell, also a triclinic one, is the unit cube
+        inverse = np.linalg.inv(cell)
+        codepos = np.mod(codepos @ inverse, 1.0)
+        plumedpos = np.mod(plumedpos @ inverse, 1.0)
+        # np.mod can round tiny negative numbers up to 1.0
+        codepos[codepos >= 1.0] = 0.0
+        plumedpos[plumedpos >= 1.0] = 0.0
+        boxsize = 1.0
+    tree = cKDTree(plumedpos, boxsize=boxsize)
+    _, nearest = tree.query(codepos)
+    if len(np.unique(nearest)) != len(nearest):
+        return None
+    order = np.empty_like(nearest)
+    order[nearest] = np.arange(len(nearest))
+    return order
+
+
+def minimumImagePositions(
+    codepos: np.ndarray, plumedpos: np.ndarray, cells: np.ndarray, natoms: int
+) -> np.ndarray:
+    """
+    Moves each atom dumped by PLUMED to its periodic image that is the closest
+    to the same atom in the MD code.
+
+    The positions of all the frames are stacked, natoms rows for each frame, and
+    cells has a row with the 9 components of the (possibly triclinic) cell of each
+    frame, as printed by PRINT ARG=c.*. The frames with no cell are not changed
+    """
+    cells = np.reshape(cells, (-1, 3, 3))
+    diff = np.reshape(plumedpos - codepos, (len(cells), natoms, 3))
+    periodic = np.abs(np.linalg.det(cells)) > 0
+    inverse = np.zeros_like(cells)
+    inverse[periodic] = np.linalg.inv(cells[periodic])
+    # the lattice vectors are the rows of the cell
+    shifts = np.round(np.einsum("fai,fij->faj", diff, inverse))
+    diff -= np.einsum("faj,fjk->fak", shifts, cells)
+    return codepos + diff.reshape(-1, 3)
 
 
 def runBasicTests(
-    outdir: str, info: dict, runMDCalcSettings: dict, tolerance: float
+    outdir: str,
+    info: dict,
+    runMDCalcSettings: dict,
+    tolerance: float,
+    withEnergy: bool = False,
+    dumpFormat: Literal["xyz", "trr"] = "xyz",
+    matchAtoms: bool = False,
+    minimumImage: bool = False,
 ) -> dict:
-    """run the (eventual) MD test for position, timestep, mass, and charge"""
+    """
+    run the (eventual) MD test for position, timestep, mass, and charge
+
+    with withEnergy the energy is also printed, so that the energy test can use this run:
+    the run is still of 10 steps, so the energy test compares 10 steps instead of the
+    150 of a separate energy run
+    with dumpFormat="trr" PLUMED (that must be compiled with xdrfile) dumps the
+    positions in a binary file
+    with matchAtoms the atoms of the MD code are paired with those of PLUMED by
+    position in the first frame (for codes that reorder the atoms), and the same
+    order is used for all the frames, the masses and the charges
+    with minimumImage the positions are compared with the minimum image convention,
+    so that the codes can wrap the atoms in the cell differently from PLUMED
+    """
     params = runMDCalcSettings["runner"].setParams()
     results = {"mdruns": {}}
     basic_md_failed = True
@@ -193,13 +633,15 @@ def runBasicTests(
         timeStepStr = ""
         if info["timestep"]:
             timeStepStr = "t1: TIME\nPRINT ARG=t1 FILE=colvar"
-        params["plumed"] = f"""DUMPATOMS ATOMS=@mdatoms FILE=plumed.xyz
+        params["plumed"] = f"""DUMPATOMS ATOMS=@mdatoms FILE=plumed.{dumpFormat}
 c: CELL
 PRINT ARG=c.* FILE=cell_data
 {dumpMassesStr}
 {timeStepStr}
 """
         params["nsteps"] = 10
+        if withEnergy:
+            params["plumed"] += "e: ENERGY\nPRINT ARG=e FILE=energy\n"
         params["ensemble"] = "npt"
         basic_md_failed = runMDCalc("basic", params=params, **runMDCalcSettings)
 
@@ -211,6 +653,7 @@ PRINT ARG=c.* FILE=cell_data
         ["basic"],
     )
     basicDir = f"{outdir}/basic_{runMDCalcSettings['version']}"
+    atomOrder = None
     if info["positions"]:
         print('Gathering data for "positions" test')
         plumednatoms = np.empty(0)
@@ -219,28 +662,17 @@ PRINT ARG=c.* FILE=cell_data
         plumedpos = np.ones(params["nsteps"])
         codecell = np.ones(params["nsteps"])
         plumedcell = np.ones(params["nsteps"])
-        if not basic_md_failed and os.path.exists(f"{basicDir}/plumed.xyz"):
+        if not basic_md_failed and os.path.exists(f"{basicDir}/plumed.{dumpFormat}"):
             # Get the trajectory that was output by PLUMED
-            plumedtraj = XYZReader(f"{basicDir}/plumed.xyz")
+            plumednatoms, plumedpos = readDumpedAtoms(f"{basicDir}/plumed.{dumpFormat}")
             # Get the number of atoms in each frame from plumed trajectory
             codenatoms = np.array(
                 runMDCalcSettings["runner"].getNumberOfAtoms(f"{basicDir}")
             )
-            plumednatoms = np.array(
-                [frame.positions.shape[0] for frame in plumedtraj.trajectory]
-            )
             # Concatenate all the trajectory frames
             codepos = np.array(runMDCalcSettings["runner"].getPositions(f"{basicDir}"))
-            first = True
-
-            for frame in plumedtraj.trajectory:
-                if first:
-                    first = False
-                    plumedpos = frame.positions.copy()
-                else:
-                    plumedpos = np.concatenate((plumedpos, frame.positions), axis=0)
             codecell = np.array(runMDCalcSettings["runner"].getCell(f"{basicDir}"))
-            plumedcell = np.loadtxt(f"{basicDir}/cell_data")[:, 1:]
+            plumedcell = colvarFields(f"{basicDir}/cell_data", CELL_FIELDS)
 
         else:
             basicSR.md_failed = True
@@ -252,13 +684,45 @@ PRINT ARG=c.* FILE=cell_data
             plumednatoms,
             0.01 * np.ones(codenatoms.shape[0]),
         )
+        # the positions of all the frames are stacked, natoms rows for each frame
+        natoms = None
+        if len(plumednatoms) > 0 and np.all(plumednatoms == plumednatoms[0]):
+            natoms = int(plumednatoms[0])
+        if matchAtoms and natoms and len(codepos) % natoms == 0:
+            atomOrder = matchAtomOrder(
+                codepos[:natoms], plumedpos[:natoms], plumedcell[0].reshape(3, 3)
+            )
+            if atomOrder is None:
+                print("The atoms of the MD code cannot be paired with those of PLUMED")
+            else:
+                # the same order is used for all the frames
+                codepos = codepos.reshape(-1, natoms, 3)[:, atomOrder].reshape(-1, 3)
+        appliedMinimumImage = False
+        if minimumImage:
+            if (
+                natoms
+                and codepos.shape == plumedpos.shape
+                and len(plumedpos) == natoms * len(plumedcell)
+            ):
+                plumedpos = minimumImagePositions(
+                    codepos, plumedpos, plumedcell, natoms
+                )
+                appliedMinimumImage = True
+            else:
+                print(
+                    "The minimum image convention cannot be used: the positions of "
+                    "the MD code and of PLUMED do not have the same frames and atoms"
+                )
         # Output results from tests on positions
         results["positions"] = basicSR.writeReportAndTable(
             "positions",
             codepos,
             plumedpos,
             tolerance * np.ones(plumedpos.shape),
+            natoms=natoms,
         )
+        results["positions"]["atomorder"] = atomOrder
+        results["positions"]["minimumimage"] = appliedMinimumImage
         # Output results from tests on cell
         results["cell"] = basicSR.writeReportAndTable(
             "cell",
@@ -272,7 +736,7 @@ PRINT ARG=c.* FILE=cell_data
         md_tstep = 0.1
         plumed_tstep = 0.1
         if not basic_md_failed:
-            plumedtimes = np.loadtxt(f"{basicDir}/colvar")[:, 1]
+            plumedtimes = colvarFields(f"{basicDir}/colvar", ["t1"])
             md_tstep = runMDCalcSettings["runner"].getTimestep()
             plumed_tstep = plumedtimes[1] - plumedtimes[0]
 
@@ -294,7 +758,9 @@ PRINT ARG=c.* FILE=cell_data
         pl_masses = np.ones(10)
         if not basic_md_failed:
             md_masses = np.array(runMDCalcSettings["runner"].getMasses(f"{basicDir}"))
-            pl_masses = np.loadtxt(f"{basicDir}/mq_plumed")[:, 1]
+            pl_masses = colvarFields(f"{basicDir}/mq_plumed", ["mass"])
+            if atomOrder is not None and len(md_masses) == len(atomOrder):
+                md_masses = md_masses[atomOrder]
 
         # Output results from tests on mass
         results["mass"] = basicSR.writeReportAndTable(
@@ -302,6 +768,7 @@ PRINT ARG=c.* FILE=cell_data
             md_masses,
             pl_masses,
             0.01 * np.ones(pl_masses.shape),
+            natoms=len(pl_masses),
         )
 
     if info["charge"]:
@@ -310,7 +777,9 @@ PRINT ARG=c.* FILE=cell_data
         pl_charges = np.ones(10)
         if not basic_md_failed:
             md_charges = np.array(runMDCalcSettings["runner"].getCharges(f"{basicDir}"))
-            pl_charges = np.loadtxt(f"{basicDir}/mq_plumed")[:, 2]
+            pl_charges = colvarFields(f"{basicDir}/mq_plumed", ["charge"])
+            if atomOrder is not None and len(md_charges) == len(atomOrder):
+                md_charges = md_charges[atomOrder]
 
         # Output results from tests on charge
         results["charge"] = basicSR.writeReportAndTable(
@@ -318,32 +787,74 @@ PRINT ARG=c.* FILE=cell_data
             md_charges,
             pl_charges,
             tolerance * np.ones(pl_charges.shape),
+            natoms=len(pl_charges),
         )
     return results
 
 
-def runForcesTest(outdir: str, runMDCalcSettings: dict, tolerance: float) -> dict:
-    # First run a calculation to find the reference distance between atom 1 and 2
+def initialDistance(basicDir: str) -> "float|None":
+    """
+    Returns the distance between atoms 1 and 2 in the first frame of the basic run,
+    computed like the DISTANCE action of PLUMED (with periodic boundary conditions),
+    or None if the basic run has not produced the needed data
+    """
+    dumpfile = dumpedAtomsFile(basicDir)
+    if dumpfile is None or not os.path.exists(f"{basicDir}/cell_data"):
+        return None
+    try:
+        positions = readDumpedAtoms(dumpfile, maxframes=1)[1]
+        cell = colvarFields(f"{basicDir}/cell_data", CELL_FIELDS)[0].reshape(3, 3)
+    except (OSError, ValueError, IndexError, KeyError):
+        return None
+    if positions.shape[0] < 2:
+        return None
+    dist = positions[1].astype(float) - positions[0]
+    if np.linalg.det(cell) == 0:
+        # no periodic boundary conditions
+        return float(np.linalg.norm(dist))
+    # the rows of cell are the lattice vectors
+    scaled = dist @ np.linalg.inv(cell)
+    scaled -= np.round(scaled)
+    # in a triclinic cell the closest image may be in one of the neighbouring cells
+    shifts = np.array(
+        [[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]
+    )
+    images = (scaled + shifts) @ cell
+    return float(np.min(np.linalg.norm(images, axis=1)))
+
+
+def runForcesTest(
+    outdir: str,
+    runMDCalcSettings: dict,
+    tolerance: float,
+    basicDir: "str|None" = None,
+) -> dict:
     version = runMDCalcSettings["version"]
     rparams = runMDCalcSettings["runner"].setParams()
-    rparams["nsteps"] = 2
-    rparams["ensemble"] = "nvt"
-    rparams["plumed"] = "dd: DISTANCE ATOMS=1,2 \nPRINT ARG=dd FILE=colvar"
-    refrun_fail = runMDCalc("refres", params=rparams, **runMDCalcSettings)
+    results = {"mdruns": {}}
+    # The reference distance between atom 1 and 2 is taken from the basic run
+    refdist = None
+    if basicDir is not None:
+        refdist = initialDistance(basicDir)
+    refrun_fail = False
+    if refdist is None:
+        # Run a short calculation to find the reference distance
+        rparams["nsteps"] = 2
+        rparams["ensemble"] = "nvt"
+        rparams["plumed"] = "dd: DISTANCE ATOMS=1,2 \nPRINT ARG=dd FILE=colvar"
+        refrun_fail = runMDCalc("refres", params=rparams, **runMDCalcSettings)
+        results["mdruns"]["refres"] = refrun_fail
+        if not refrun_fail:
+            refdist = colvarFields(f"{outdir}/refres_{version}/colvar", ["dd"])[0]
     mdrun_fail = True
     plrun_fail = True
-    results = {"mdruns": {}}
-    results["mdruns"]["refres"] = refrun_fail
     if not refrun_fail:
-        # Get the reference distance between the atoms
-        refdist = np.loadtxt(f"{outdir}/refres_{version}/colvar")[0, 1]
         # Run the calculation with the restraint applied by the MD code
         rparams["nsteps"] = 20
         rparams["ensemble"] = "nvt"
         rparams["restraint"] = refdist
         rparams["plumed"] = "dd: DISTANCE ATOMS=1,2 \nPRINT ARG=dd FILE=colvar"
-        mdrun_fail = runMDCalc("forces1", params=rparams, **runMDCalcSettings)
-        results["mdruns"]["forces1"] = mdrun_fail
+        jobs = {"forces1": dict(rparams)}
         # Run the calculation with the restraint applied by PLUMED
         rparams["restraint"] = -10
         rparams["plumed"] = (
@@ -351,15 +862,19 @@ def runForcesTest(outdir: str, runMDCalcSettings: dict, tolerance: float) -> dic
             f"RESTRAINT ARG=dd KAPPA=2000 AT={refdist}\n"
             "PRINT ARG=dd FILE=colvar\n"
         )
-        plrun_fail = runMDCalc("forces2", params=rparams, **runMDCalcSettings)
+        jobs["forces2"] = dict(rparams)
+        mdruns = runMDCalcs(jobs, **runMDCalcSettings)
+        mdrun_fail = mdruns["forces1"]
+        plrun_fail = mdruns["forces2"]
+        results["mdruns"]["forces1"] = mdrun_fail
         results["mdruns"]["forces2"] = plrun_fail
     # And create our reports from the two runs
     md_failed = mdrun_fail or plrun_fail
     val1 = np.ones(1)
     val2 = np.ones(1)
     if not md_failed:
-        val1 = np.loadtxt(f"{outdir}/forces1_{version}/colvar")[:, 1]
-        val2 = np.loadtxt(f"{outdir}/forces2_{version}/colvar")[:, 1]
+        val1 = colvarFields(f"{outdir}/forces1_{version}/colvar", ["dd"])
+        val2 = colvarFields(f"{outdir}/forces2_{version}/colvar", ["dd"])
     print('Gathering data for "forces" test')
     results["forces"] = writeReportForSimulations(
         runMDCalcSettings["code"],
@@ -376,34 +891,172 @@ def runForcesTest(outdir: str, runMDCalcSettings: dict, tolerance: float) -> dic
     return results
 
 
-def runVirialTest(outdir: str, runMDCalcSettings: dict, tolerance: float) -> dict:
+# the calculations of the tests that are repeated with more MPI ranks
+SCALING_RUNS = ("basic", "refres", "forces1", "forces2")
+
+
+def scalingEntry(results: dict, usage: dict) -> dict:
+    """The failure rates of the basic and forces tests and the wall time of their runs"""
+    return {
+        "failure_rate": {
+            test: results[test]["failure_rate"]
+            for test in BASIC_TEST_ORDER
+            if test in results
+        },
+        "wall": sum(usage[name]["wall"] for name in SCALING_RUNS if name in usage),
+    }
+
+
+def runRankScaling(
+    outdir: str,
+    info: dict,
+    runMDCalcSettings: dict,
+    tolerance: float,
+    ranks: "list[int]",
+    **basicSettings,
+) -> dict:
+    """
+    Runs the basic and the forces tests again with each number of MPI ranks in ranks,
+    if the runner has withMPI.
+
+    The calculations are labelled with the version and the number of ranks
+    (e.g. basic_v2.10_np4). basicSettings are passed to runBasicTests.
+    Returns the failure rates and the wall time for each number of ranks
+    """
     version = runMDCalcSettings["version"]
+    journal = runMDCalcSettings.get("journal")
+    scaling = {}
+    if not getattr(runMDCalcSettings["runner"], "withMPI", False):
+        # the runner would run the code on one rank whatever the number of ranks
+        print("This code cannot be run on more MPI ranks, the scaling is not measured")
+        return scaling
+    for nranks in ranks:
+        label = f"{version}_np{nranks}"
+        print(f"Running the basic and forces tests with {nranks} MPI ranks")
+        # the label is only used for the directories, the executable is the one of version
+        settings = dict(
+            runMDCalcSettings,
+            version=label,
+            mpiranks=nranks,
+            usage={},
+            execSuffix=runMDCalcSettings.get("execSuffix") or f"_{version}",
+        )
+        if journal is not None:
+            settings["journal"] = RunJournal(
+                f"{outdir}/journal_{label}.json", journal.resume
+            )
+        results = runBasicTests(outdir, info, settings, tolerance, **basicSettings)
+        if info["forces"]:
+            basicDir = None
+            if not results["mdruns"].get("basic", True):
+                basicDir = f"{outdir}/basic_{label}"
+            results.update(runForcesTest(outdir, settings, tolerance, basicDir))
+        scaling[nranks] = scalingEntry(results, settings["usage"])
+    return scaling
+
+
+# the number of steps and the typical PLUMED input of the benchmark
+BENCHMARK_STEPS = 500
+BENCHMARK_PLUMED = (
+    "c: COORDINATION GROUPA=@mdatoms R_0=0.3 NLIST NL_CUTOFF=1.0 NL_STRIDE=10\n"
+    "rg: GYRATION ATOMS=@mdatoms\n"
+    "d: DISTANCE ATOMS=1,2\n"
+    "PRINT ARG=c,rg,d FILE=colvar STRIDE=10\n"
+)
+
+
+def runBenchmark(
+    outdir: str, runMDCalcSettings: dict, nsteps: int = BENCHMARK_STEPS
+) -> dict:
+    """
+    Measures what PLUMED costs to the MD code, running the same calculation
+    without PLUMED (if the runner has withoutPlumed), with an empty PLUMED input
+    and with a typical set of collective variables.
+
+    The ns/day are read with the getPerformance method of the runner, if it has one,
+    otherwise they are estimated from the wall time of the calculation
+    """
+    version = runMDCalcSettings["version"]
+    runner = runMDCalcSettings["runner"]
+    params = runner.setParams()
+    params["nsteps"] = nsteps
+    params["ensemble"] = "nvt"
+    jobs = {}
+    if getattr(runner, "withoutPlumed", False):
+        jobs["bench_noplumed"] = dict(params, plumed=None)
+    jobs["bench_empty"] = dict(params, plumed="")
+    jobs["bench_cv"] = dict(params, plumed=BENCHMARK_PLUMED)
+    usage = runMDCalcSettings["usage"]
+    results = {"mdruns": {}, "benchmark": {"nsteps": nsteps, "runs": {}}}
+    for name, jobparams in jobs.items():
+        # one at a time, so that the calculations do not compete for the cores
+        failed = runMDCalc(name, params=jobparams, **runMDCalcSettings)
+        results["mdruns"][name] = failed
+        if failed:
+            continue
+        nsday, source = None, "log"
+        if hasattr(runner, "getPerformance"):
+            nsday = runner.getPerformance(f"{outdir}/{name}_{version}")
+        if nsday is None and name in usage and usage[name]["wall"] > 0:
+            # the ns simulated over the days it took
+            nsday = nsteps * runner.getTimestep() * 1e-3 * 86400 / usage[name]["wall"]
+            source = "wall time"
+        if nsday is not None:
+            results["benchmark"]["runs"][name] = {"nsday": nsday, "source": source}
+    # the overhead is measured with respect to the code without PLUMED, if possible
+    runs = results["benchmark"]["runs"]
+    reference = next((name for name in jobs if name in runs), None)
+    results["benchmark"]["reference"] = reference
+    for name, run in runs.items():
+        run["overhead"] = 100 * (runs[reference]["nsday"] / run["nsday"] - 1)
+    return results
+
+
+def runVirialTest(
+    outdir: str, runMDCalcSettings: dict, tolerance: float, earlyStop: float = 0.0
+) -> dict:
+    version = runMDCalcSettings["version"]
+    # with earlyStop PLUMED must write the volume at every step
+    flush = "FLUSH STRIDE=1\n" if earlyStop > 0 else ""
     params = runMDCalcSettings["runner"].setParams()
     params["nsteps"] = 50
     params["ensemble"] = "npt"
-    params["plumed"] = "vv: VOLUME \n PRINT ARG=vv FILE=volume"
-    run1_fail = runMDCalc("virial1", params=params, **runMDCalcSettings)
+    params["plumed"] = "vv: VOLUME \n PRINT ARG=vv FILE=volume\n" + flush
+    jobs = {"virial1": dict(params)}
     params["pressure"] = 1001 * params["pressure"]
-    run3_fail = runMDCalc("virial3", params=params, **runMDCalcSettings)
+    jobs["virial3"] = dict(params)
     params["plumed"] = (
         "vv: VOLUME\n"
         "RESTRAINT AT=0.0 ARG=vv SLOPE=-60.221429\n"
-        "PRINT ARG=vv FILE=volume\n"
+        "PRINT ARG=vv FILE=volume\n" + flush
     )
-    run2_fail = runMDCalc("virial2", params=params, **runMDCalcSettings)
+    jobs["virial2"] = dict(params)
+    decision = {}
+    if earlyStop > 0:
+        stopWhen, decision = perturbationStopper(
+            outdir, version, "virial", "volume", ["vv"], earlyStop, tolerance
+        )
+        mdruns = runConcurrentMDCalcs(
+            jobs, outdir, runMDCalcSettings, stopWhen=stopWhen
+        )
+    else:
+        mdruns = runMDCalcs(jobs, **runMDCalcSettings)
     results = {"mdruns": {}}
-    results["mdruns"]["virial1"] = run1_fail
-    results["mdruns"]["virial2"] = run2_fail
-    results["mdruns"]["virial3"] = run3_fail
-    md_failed = run1_fail or run2_fail or run3_fail
+    results["mdruns"]["virial1"] = mdruns["virial1"]
+    results["mdruns"]["virial2"] = mdruns["virial2"]
+    results["mdruns"]["virial3"] = mdruns["virial3"]
+    md_failed = mdruns["virial1"] or mdruns["virial2"] or mdruns["virial3"]
     val1 = np.ones(1)
     val2 = np.ones(1)
     val3 = np.ones(1)
 
     if not md_failed:
-        val1 = np.loadtxt(f"{outdir}/virial1_{version}/volume")[:, 1]
-        val2 = np.loadtxt(f"{outdir}/virial2_{version}/volume")[:, 1]
-        val3 = np.loadtxt(f"{outdir}/virial3_{version}/volume")[:, 1]
+        val1 = colvarFields(f"{outdir}/virial1_{version}/volume", ["vv"])
+        val2 = colvarFields(f"{outdir}/virial2_{version}/volume", ["vv"])
+        val3 = colvarFields(f"{outdir}/virial3_{version}/volume", ["vv"])
+        # the runs may have been stopped at different steps, also in a resumed sweep
+        nframes = decision.get("frames", min(len(val1), len(val2), len(val3)))
+        val1, val2, val3 = val1[:nframes], val2[:nframes], val3[:nframes]
     print('Gathering data for "virial" test')
     results["virial"] = writeReportForSimulations(
         runMDCalcSettings["code"],
@@ -417,6 +1070,8 @@ def runVirialTest(outdir: str, runMDCalcSettings: dict, tolerance: float) -> dic
         np.abs(val3 - val1),
         denominatorTolerance=tolerance,
     )
+    if "frames" in decision:
+        results["virial"]["earlystop"] = decision["frames"]
 
     return results
 
@@ -430,40 +1085,56 @@ def energyTest(
     runMDCalcSettings: dict,
     tolerance: float = 0.0,
     prerelaxtime: bool = False,
+    earlyStop: float = 0.0,
 ) -> dict:
     alpha = sqrtalpha * sqrtalpha
     version = runMDCalcSettings["version"]
+    # with earlyStop PLUMED must write the energy at every step
+    flush = "FLUSH STRIDE=1\n" if earlyStop > 0 else ""
     params = runMDCalcSettings["runner"].setParams()
     params["nsteps"] = nsteps
     params["ensemble"] = ensemble
-    params["plumed"] = "e: ENERGY\n" "v: VOLUME\n" "PRINT ARG=e,v FILE=energy\n"
-    run1_fail = runMDCalc(f"{title}1", params=params, **runMDCalcSettings)
+    params["plumed"] = "e: ENERGY\n" "v: VOLUME\n" "PRINT ARG=e,v FILE=energy\n" + flush
+    jobs = {f"{title}1": dict(params)}
     params["temperature"] = params["temperature"] * alpha
     params["relaxtime"] = params["relaxtime"] / sqrtalpha
     if prerelaxtime:
         params["prelaxtime"] = params["prelaxtime"] / sqrtalpha
     params["tstep"] = params["tstep"] / sqrtalpha
-    run3_fail = runMDCalc(f"{title}3", params=params, **runMDCalcSettings)
+    jobs[f"{title}3"] = dict(params)
     params["plumed"] = (
         "e: ENERGY\n"
         "v: VOLUME\n"
         "PRINT ARG=e,v FILE=energy\n"
-        f"RESTRAINT AT=0.0 ARG=e SLOPE={alpha - 1}\n"
+        f"RESTRAINT AT=0.0 ARG=e SLOPE={alpha - 1}\n" + flush
     )
-    run2_fail = runMDCalc(f"{title}2", params=params, **runMDCalcSettings)
+    jobs[f"{title}2"] = dict(params)
+    decision = {}
+    if earlyStop > 0:
+        stopWhen, decision = perturbationStopper(
+            outdir, version, title, "energy", ["e", "v"], earlyStop, tolerance
+        )
+        mdruns = runConcurrentMDCalcs(
+            jobs, outdir, runMDCalcSettings, stopWhen=stopWhen
+        )
+    else:
+        mdruns = runMDCalcs(jobs, **runMDCalcSettings)
     results = {"mdruns": {}}
-    results["mdruns"][f"{title}1"] = run1_fail
-    results["mdruns"][f"{title}2"] = run2_fail
-    results["mdruns"][f"{title}3"] = run3_fail
-    md_failed = run1_fail or run2_fail or run3_fail
+    results["mdruns"][f"{title}1"] = mdruns[f"{title}1"]
+    results["mdruns"][f"{title}2"] = mdruns[f"{title}2"]
+    results["mdruns"][f"{title}3"] = mdruns[f"{title}3"]
+    md_failed = mdruns[f"{title}1"] or mdruns[f"{title}2"] or mdruns[f"{title}3"]
     val1 = np.ones(1)
     val2 = np.ones(1)
     val3 = np.ones(1)
 
     if not md_failed:
-        val1 = np.loadtxt(f"{outdir}/{title}1_{version}/energy")[:, 1:]
-        val2 = np.loadtxt(f"{outdir}/{title}2_{version}/energy")[:, 1:]
-        val3 = np.loadtxt(f"{outdir}/{title}3_{version}/energy")[:, 1:]
+        val1 = colvarFields(f"{outdir}/{title}1_{version}/energy", ["e", "v"])
+        val2 = colvarFields(f"{outdir}/{title}2_{version}/energy", ["e", "v"])
+        val3 = colvarFields(f"{outdir}/{title}3_{version}/energy", ["e", "v"])
+        # the runs may have been stopped at different steps, also in a resumed sweep
+        nframes = decision.get("frames", min(len(val1), len(val2), len(val3)))
+        val1, val2, val3 = val1[:nframes], val2[:nframes], val3[:nframes]
     print(f'Gathering data for "{title}" test')
     results[title] = writeReportForSimulations(
         runMDCalcSettings["code"],
@@ -478,27 +1149,43 @@ def energyTest(
         denominatorTolerance=tolerance,
     )
     results[title]["sqrtalpha"] = sqrtalpha
+    if "frames" in decision:
+        results[title]["earlystop"] = decision["frames"]
     return results
 
 
 def runEnergyTests(
-    outdir: str, info: dict, runMDCalcSettings: dict, tolerance: float
+    outdir: str,
+    info: dict,
+    runMDCalcSettings: dict,
+    tolerance: float,
+    earlyStop: float = 0.0,
+    combinedRun: "tuple[str, bool|int]|None" = None,
 ) -> dict:
+    """
+    combinedRun is the name and the exit code of a run that has already printed
+    the energy (see runBasicTests), if it is None a new run is done
+    """
     code = runMDCalcSettings["code"]
     version = runMDCalcSettings["version"]
-    params = runMDCalcSettings["runner"].setParams()
-    params["nsteps"] = 150
-    params["ensemble"] = "npt"
-    params["plumed"] = "e: ENERGY \nPRINT ARG=e FILE=energy"
-    md_failed = runMDCalc("energy", params=params, **runMDCalcSettings)
     results = {"mdruns": {}}
-    results["mdruns"]["energy"] = md_failed
+    if combinedRun is None:
+        params = runMDCalcSettings["runner"].setParams()
+        params["nsteps"] = 150
+        params["ensemble"] = "npt"
+        params["plumed"] = "e: ENERGY \nPRINT ARG=e FILE=energy"
+        energyRun = "energy"
+        md_failed = runMDCalc(energyRun, params=params, **runMDCalcSettings)
+        results["mdruns"]["energy"] = md_failed
+    else:
+        energyRun, md_failed = combinedRun
+    energyDir = f"{outdir}/{energyRun}_{version}"
     md_energy = np.ones(1)
     pl_energy = np.ones(1)
 
-    if not md_failed and os.path.exists(f"{outdir}/energy_{version}/energy"):
-        md_energy = runMDCalcSettings["runner"].getEnergy(f"{outdir}/energy_{version}")
-        pl_energy = np.loadtxt(f"{outdir}/energy_{version}/energy")[:, 1]
+    if not md_failed and os.path.exists(f"{energyDir}/energy"):
+        md_energy = runMDCalcSettings["runner"].getEnergy(energyDir)
+        pl_energy = colvarFields(f"{energyDir}/energy", ["e"])
 
     else:
         md_failed = True
@@ -507,7 +1194,7 @@ def runEnergyTests(
         code,
         version,
         md_failed,
-        ["energy"],
+        [energyRun],
     ).writeReportAndTable(
         "energy",
         md_energy,
@@ -531,6 +1218,7 @@ def runEnergyTests(
                 sqrtalpha,
                 runMDCalcSettings,
                 tolerance,
+                earlyStop=earlyStop,
             )
         )
 
@@ -546,6 +1234,7 @@ def runEnergyTests(
                 runMDCalcSettings,
                 tolerance,
                 prerelaxtime=True,
+                earlyStop=earlyStop,
             )
         )
     return results
@@ -558,6 +1247,12 @@ def runTests(
     *,
     prefix: str = "",
     settingsFor_runMDCalc: dict = {},
+    earlyStop: float = 0.0,
+    combineRuns: bool = False,
+    dumpFormat: Literal["xyz", "trr"] = "xyz",
+    resume: bool = False,
+    mpiRanks: "list[int]" = [],
+    benchmark: bool = False,
 ) -> dict:
     # Read in the information on the tests that should be run for this code
     basedir = f"tests/{code}"
@@ -580,26 +1275,71 @@ def runTests(
         runner=runner,
         prefix=prefix,
         executible=ymldata["executible"],
+        usage={},
+        # with resume the calculations that were completed are not repeated
+        journal=RunJournal(f"{outdir}/journal_{version}.json", resume),
         **settingsFor_runMDCalc,
     )
-    results = runBasicTests(outdir, info, runMDCalcSettings, tolerance)
+    # the energy can be printed by the basic run, that is done in the npt ensemble
+    combineRuns = (
+        combineRuns
+        and info["energy"]
+        and (info["positions"] or info["timestep"] or info["mass"] or info["charge"])
+    )
+    basicSettings = dict(
+        withEnergy=combineRuns,
+        dumpFormat=dumpFormat,
+        matchAtoms=ymldata.get("match_atoms", False),
+        minimumImage=ymldata.get("minimum_image", False),
+    )
+    results = runBasicTests(outdir, info, runMDCalcSettings, tolerance, **basicSettings)
     mddict = results["mdruns"]
-    # the next runs are not based on the basic run
     if info["forces"]:
-        tmp = runForcesTest(outdir, runMDCalcSettings, tolerance)
+        basicDir = None
+        if not results["mdruns"]["basic"]:
+            basicDir = f"{outdir}/basic_{version}"
+        tmp = runForcesTest(outdir, runMDCalcSettings, tolerance, basicDir)
         mddict.update(tmp["mdruns"])
         results.update(tmp)
 
     if info["virial"]:
-        tmp = runVirialTest(outdir, runMDCalcSettings, tolerance)
+        tmp = runVirialTest(outdir, runMDCalcSettings, tolerance, earlyStop)
         mddict.update(tmp["mdruns"])
         results.update(tmp)
 
     if info["energy"]:
-        tmp = runEnergyTests(outdir, info, runMDCalcSettings, tolerance)
+        combinedRun = None
+        if combineRuns:
+            combinedRun = ("basic", mddict["basic"])
+        tmp = runEnergyTests(
+            outdir, info, runMDCalcSettings, tolerance, earlyStop, combinedRun
+        )
         mddict.update(tmp["mdruns"])
         results.update(tmp)
+    if benchmark or info.get("benchmark", False):
+        tmp = runBenchmark(
+            outdir, runMDCalcSettings, ymldata.get("benchmark_steps", BENCHMARK_STEPS)
+        )
+        mddict.update(tmp["mdruns"])
+        results["benchmark"] = tmp["benchmark"]
+
+    if len(mpiRanks) > 0:
+        # the runs above are the reference for the scaling with the number of ranks
+        nranks = runMDCalcSettings.get("mpiranks", 1)
+        results["scaling"] = {nranks: scalingEntry(results, runMDCalcSettings["usage"])}
+        results["scaling"].update(
+            runRankScaling(
+                outdir,
+                info,
+                runMDCalcSettings,
+                tolerance,
+                [n for n in mpiRanks if n != nranks],
+                # the energy is not checked in the scaling runs
+                **dict(basicSettings, withEnergy=False),
+            )
+        )
     results["mdruns"] = mddict
+    results["usage"] = runMDCalcSettings["usage"]
     return results
 
 
@@ -609,7 +1349,12 @@ def writeMDReport(
     results: dict,
     *,
     prefix: str = "",
+    buildVersion: "str|None" = None,
 ):
+    """
+    buildVersion is the version of the build of the code that was used, if different
+    from version (when a PLUMED kernel is loaded at runtime)
+    """
     # Read in the information on the tests that should be run for this code
     basedir = f"tests/{code}"
     outdir = basedir
@@ -685,7 +1430,32 @@ def writeMDReport(
                     testout.write(dictToTestoutTableEntry(results[test]))
             test_energy_result = testOpinion(howbad)
 
-    ymldata = yamlToDict(f"{basedir}/info.yml", Loader=yaml.SafeLoader)
+        if "usage" in results.keys() and len(results["usage"]) > 0:
+            testout.write("\n\n## Resources used by the calculations\n\n")
+            testout.write(dictToUsageTable(results["usage"]))
+            testout.write(
+                "\nThe peak RSS is the largest resident set size reached by the "
+                "processes of each calculation, read while they run: it can be 0 "
+                "for calculations that last less than a tenth of a second.\n"
+            )
+
+        if "benchmark" in results.keys() and len(results["benchmark"]["runs"]) > 0:
+            testout.write("\n\n## Cost of PLUMED\n\n")
+            testout.write(dictToBenchmarkTable(results["benchmark"]))
+
+        if "scaling" in results.keys():
+            testout.write("\n\n## Scaling with the number of MPI ranks\n\n")
+            testout.write(dictToScalingTable(results["scaling"]))
+            testout.write(
+                "\nThe basic and forces tests are repeated with each number of ranks, "
+                "the wall time is the one of all their calculations.\n"
+            )
+
+    # the results of the other versions are kept, also when the prefix is used
+    infofile = f"{outdir}/info.yml"
+    if not os.path.exists(infofile):
+        infofile = f"{basedir}/info.yml"
+    ymldata = yamlToDict(infofile, Loader=yaml.SafeLoader)
     if "results" not in ymldata.keys():
         ymldata["results"] = {}
     str_version = str(version)
@@ -694,12 +1464,30 @@ def writeMDReport(
         ymldata["results"][str_version]["test_plumed"] = result_dict 
     else:
         ymldata["results"][str_version] = {"test_plumed": result_dict}
+    # the code was not compiled for this version: it has the status of the build used
+    if (
+        buildVersion is not None
+        and "install_plumed" not in ymldata["results"][str_version]
+        and "install_plumed" in ymldata["results"].get(buildVersion, {})
+    ):
+        ymldata["results"][str_version]["install_plumed"] = ymldata["results"][
+            buildVersion
+        ]["install_plumed"]
+    # the wall time of each calculation, for the performance history (see build.py)
+    if len(results.get("usage", {})) > 0:
+        ymldata["results"][str_version]["timings"] = {
+            name: round(use["wall"], 3) for name, use in results["usage"].items()
+        }
     with open(f"{outdir}/info.yml", "w") as infoOut:
         infoOut.write(yaml.dump(ymldata, sort_keys=False))
 
 
 def writeTermReport(
-    code: str, version: Literal["master", "stable"], results: dict, space=80
+    code: str,
+    version: Literal["master", "stable"],
+    results: dict,
+    space=80,
+    profileDir: "str|None" = None,
 ):
     howbad = []
     description_space = space - len(" failure rate: 123%")
@@ -716,10 +1504,77 @@ def writeTermReport(
             if len(title) > description_space:
                 title = title[: (description_space - 3)] + "..."
             print(f"{title:<{description_space}} failure rate: {failure_rate}")
+            comparison = results[test].get("comparison")
+            if howbad[-1] != "success" and comparison and comparison["worst"]:
+                # where the largest difference is
+                worst = comparison["worst"][0]
+                where = f"element {worst['index']}"
+                if "atom" in worst:
+                    where = f"frame {worst['frame']}, atom {worst['atom']}"
+                col1, col2, _ = comparisonColumns(results[test]["zipfiles"])
+                print(
+                    f"     largest difference: {worst['percent_diff']:.1f}% at {where}"
+                    f" ({col1} {worst['ref']:.4f}, {col2} {worst['data']:.4f})"
+                )
 
     test_result = testOpinion(howbad)
     print()
     print(f"Test result for {code} with version {version}: {test_result}")
+    if "positions" in results.keys():
+        atomOrder = results["positions"].get("atomorder")
+        if atomOrder is not None:
+            moved = np.count_nonzero(atomOrder != np.arange(len(atomOrder)))
+            print(f"{moved} atoms of the MD code were reordered to match PLUMED")
+    for test in VIRIAL_TEST_ORDER + ENERGY_TEST_ORDER:
+        if test in results.keys() and "earlystop" in results[test]:
+            print(
+                f'The "{test}" runs were stopped early, '
+                f"after {results[test]['earlystop']} frames"
+            )
+    if "benchmark" in results.keys() and len(results["benchmark"]["runs"]) > 0:
+        print()
+        print(f"{'Benchmark run':<16}{'ns/day':>12}{'overhead':>10}  from")
+        for name, run in results["benchmark"]["runs"].items():
+            print(
+                f"{name:<16}{run['nsday']:>12.3f}{run['overhead']:>9.1f}%  {run['source']}"
+            )
+    if "scaling" in results.keys():
+        print()
+        tests = list(next(iter(results["scaling"].values()))["failure_rate"])
+        print(f"{'MPI ranks':<10}{'wall (s)':>10}" + "".join(f"{t:>11}" for t in tests))
+        for nranks, entry in results["scaling"].items():
+            rates = [formatFailureRate(entry["failure_rate"].get(t, -1)) for t in tests]
+            print(
+                f"{nranks:<10}{entry['wall']:>10.2f}"
+                + "".join(f"{r:>11}" for r in rates)
+            )
+    if "usage" in results.keys() and len(results["usage"]) > 0:
+        print()
+        print(
+            f"{'Calculation':<16}{'wall (s)':>10}{'user (s)':>10}{'sys (s)':>10}"
+            f"{'RSS (MB)':>10}{'read (MB)':>11}{'write (MB)':>11}"
+        )
+        for name, usage in results["usage"].items():
+            read = "-" if usage["read"] is None else f"{usage['read'] / 2**20:.1f}"
+            written = (
+                "-" if usage["written"] is None else f"{usage['written'] / 2**20:.1f}"
+            )
+            print(
+                f"{name:<16}{usage['wall']:>10.2f}{usage['user']:>10.2f}"
+                f"{usage['sys']:>10.2f}{usage['maxrss'] / 2**20:>10.1f}"
+                f"{read:>11}{written:>11}"
+            )
+    if profileDir is not None:
+        # where the python code of the harness spent its time
+        for step, rows in profileSummary(profileDir, version).items():
+            print()
+            print(f"Profile of {step} (saved in {profileDir})")
+            print(f"{'cumtime (s)':>12}{'tottime (s)':>12}{'calls':>9}  function")
+            for row in rows:
+                print(
+                    f"{row['cumtime']:>12.3f}{row['tottime']:>12.3f}"
+                    f"{row['ncalls']:>9}  {row['function']}"
+                )
 
 
 if __name__ == "__main__":
@@ -732,18 +1587,65 @@ if __name__ == "__main__":
     argv = sys.argv[1:]
     try:
         opts, args = getopt.getopt(
-            argv, "hc:v:p", ["version=", "prepare-pages", "code="]
+            argv,
+            "hc:v:pt:",
+            [
+                "version=",
+                "prepare-pages",
+                "code=",
+                "threads=",
+                "cores=",
+                "early-stop=",
+                "combine-runs",
+                "dump-format=",
+                "kernel=",
+                "exec-suffix=",
+                "backend=",
+                "resume",
+                "ranks=",
+                "launcher=",
+                "benchmark",
+                "profile",
+                "profile-workers",
+            ],
         )
     except getopt.GetoptError as err:
         # print help information and exit:
         print(err)  # will print something like "option -a not recognized"
-        print("runtests.py -c <code> -v <version>")
+        print(
+            "runtests.py -c <code> -v <version> [-t <threads>] [--cores=<list>]"
+            " [--early-stop=<confidence>] [--combine-runs]"
+            " [--dump-format=xyz|trr] [--kernel=<label>=<path> ...]"
+            " [--exec-suffix=<suffix>]"
+            " [--backend=serial|pool[:<n>]|slurm[:<options>]] [--resume]"
+            " [--ranks=<list>] [--launcher=<command>] [--benchmark]"
+            " [--profile] [--profile-workers]"
+        )
         sys.exit(1)
 
     preparepages = False
+    earlyStop = 0.0
+    combineRuns = False
+    dumpFormat = "xyz"
+    kernels = []
+    execSuffix = "_master"
+    resume = False
+    mpiRanks = []
+    benchmark = False
+    profile = False
+    profileWorkers = False
+    settingsFor_runMDCalc = {}
     for opt, arg in opts:
         if opt in ["-h"]:
-            print("runtests.py -c <code> -v <version>")
+            print(
+                "runtests.py -c <code> -v <version> [-t <threads>] [--cores=<list>]"
+                " [--early-stop=<confidence>] [--combine-runs]"
+                " [--dump-format=xyz|trr] [--kernel=<label>=<path> ...]"
+                " [--exec-suffix=<suffix>]"
+                " [--backend=serial|pool[:<n>]|slurm[:<options>]] [--resume]"
+                " [--ranks=<list>] [--launcher=<command>] [--benchmark]"
+                " [--profile] [--profile-workers]"
+            )
             sys.exit()
         elif opt in ["-c", "--code"]:
             code = arg
@@ -751,14 +1653,61 @@ if __name__ == "__main__":
             preparepages = True
         elif opt in ["-v", "--version"]:
             version = arg
-
+        elif opt in ["-t", "--threads"]:
+            settingsFor_runMDCalc["nthreads"] = int(arg)
+        elif opt in ["--cores"]:
+            # a list of cores like 0-3,8
+            settingsFor_runMDCalc["cores"] = parseCoreList(arg)
+        elif opt in ["--early-stop"]:
+            # the confidence level, e.g. 0.99
+            earlyStop = float(arg)
+        elif opt in ["--combine-runs"]:
+            combineRuns = True
+        elif opt in ["--dump-format"]:
+            dumpFormat = arg
+        elif opt in ["--kernel"]:
+            # a label for the version and the path to its libplumedKernel.so
+            kernels.append(arg)
+        elif opt in ["--exec-suffix"]:
+            # the suffix of the executable that loads the kernels at runtime
+            execSuffix = arg
+        elif opt in ["--backend"]:
+            # how the calculations are run, see makeBackend in backends.py
+            settingsFor_runMDCalc["backend"] = makeBackend(arg)
+        elif opt in ["--resume"]:
+            # do not repeat the calculations that were completed by a previous attempt
+            resume = True
+        elif opt in ["--ranks"]:
+            # the numbers of MPI ranks of the basic and forces tests, like 1,2,4
+            mpiRanks = parseCoreList(arg)
+        elif opt in ["--launcher"]:
+            # the MPI launcher, with {ranks} in place of the number of ranks
+            settingsFor_runMDCalc["launcher"] = arg
+        elif opt in ["--benchmark"]:
+            # measure the cost of PLUMED, also if info.yml does not ask for it
+            benchmark = True
+        elif opt in ["--profile"]:
+            # profile the python code of the harness with cProfile
+            profile = True
+        elif opt in ["--profile-workers"]:
+            # profile also the processes that run the calculations
+            profile = True
+            profileWorkers = True
+
+    profileDir = None
+    if profile:
+        profileDir = profileDirectory(f"tests/{code}")
+        print(f"The profiles of the harness are saved in {profileDir}")
+        if profileWorkers:
+            settingsFor_runMDCalc["profileDir"] = profileDir
     if preparepages:
         # Build all the pages that describe the tests for this code
         # buildTestPages("tests/" + code)
         # Engforces and engvir share the same procedure
         shutil.copy("templates/engforces.md", "templates/engvir.md")
         # Build the default test pages
-        buildTestPages("templates", "pages")
+        with profiled(profileFile(profileDir, "buildTestPages")):
+            buildTestPages("templates", "pages")
     # Create an __init__.py module for the desired code
     with open(f"tests/{code}/__init__.py", "w+") as ipf:
         ipf.write("from .mdcode import mdcode\n")
@@ -774,7 +1723,34 @@ if __name__ == "__main__":
     myMDcode = importlib.import_module("tests." + code, "mdcode")
     # And create the class that interfaces with the MD code output
     runner = myMDcode.mdcode()
-    # Now run the tests
-    results = runTests(code, version, runner)
-    writeMDReport(code, version, results)
-    writeTermReport(code, version, results)
+    # Each kernel is tested with the same executable, linked at runtime
+    versions = {version: {}}
+    if len(kernels) > 0:
+        versions = {
+            label: dict(plumedKernel=kernel, execSuffix=execSuffix)
+            for label, kernel in parseKernelList(kernels).items()
+        }
+    for version, kernelSettings in versions.items():
+        # Now run the tests
+        if profileDir is not None:
+            # the profiles of the other versions are kept
+            cleanProfiles(profileDir, version)
+        with profiled(profileFile(profileDir, f"runTests_{version}")):
+            results = runTests(
+                code,
+                version,
+                runner,
+                settingsFor_runMDCalc=dict(settingsFor_runMDCalc, **kernelSettings),
+                earlyStop=earlyStop,
+                combineRuns=combineRuns,
+                dumpFormat=dumpFormat,
+                resume=resume,
+                mpiRanks=mpiRanks,
+                benchmark=benchmark,
+            )
+        buildVersion = None
+        if len(kernels) > 0:
+            buildVersion = execSuffix.lstrip("_")
+        with profiled(profileFile(profileDir, f"writeMDReport_{version}")):
+            writeMDReport(code, version, results, buildVersion=buildVersion)
+        writeTermReport(code, version, results, profileDir=profileDir)
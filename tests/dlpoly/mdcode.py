@@ -1,8 +1,18 @@
+import os
 import numpy as np
-import MDAnalysis as mda
 import subprocess
+from mdhelper import launchCommand
 
 class mdcode :
+   # the code can be run with mdparams["plumed"] set to None, for the benchmark
+   withoutPlumed = True
+   # the code is run on mdparams["mpiranks"] MPI ranks, for the scaling with --ranks
+   withMPI = True
+
+   def __init__( self ) :
+       # cache of the data read from HISTORY, keyed by file name
+       self._historycache = {}
+
    def setParams( self ) :
        params = {
          "temperature": 300,
@@ -26,6 +36,8 @@ ensemble_method               hoover
 ensemble_thermostat_coupling  {mdparams["relaxtime"]} ps
 ensemble_barostat_coupling    {mdparams["prelaxtime"]} ps
 """
+       plumed_stuff = "plumed                on\nplumed_input          plumed.dat"
+       if mdparams["plumed"] is None : plumed_stuff = "plumed                off"
        inp = f"""
 title                 PLUMED test calc
 io_file_config        CONFIG
@@ -35,8 +47,7 @@ io_file_revive        REVIVE
 io_file_revcon        REVCON
 io_file_tabvdw        TABLE
 temperature           {mdparams["temperature"]} K
-plumed                on
-plumed_input          plumed.dat
+{plumed_stuff}
 print_frequency       1 steps
 stats_frequency       1 steps
 vdw_cutoff            8.0 ang
@@ -63,30 +74,51 @@ traj_interval         1 steps
        # Now run the calculation using subprocess
        with open("stdout","w") as stdout:
         with open("stderr","w") as stderr:
-          out = subprocess.run([executible], text=True, input=inp, stdout=stdout, stderr=stderr )
+          out = subprocess.run(launchCommand([executible], mdparams), text=True, input=inp, stdout=stdout, stderr=stderr )
        return out.returncode
 
    def getTimestep( self ) :
        return 0.001
 
+   def _readHistory( self, rundir ) :
+       fname = rundir + "/HISTORY"
+       mtime = os.path.getmtime( fname )
+       if fname in self._historycache and self._historycache[fname][0]==mtime : return self._historycache[fname][1]
+       f = open( fname, "r" )
+       lines = f.read().splitlines()
+       f.close()
+       # Second line is keytrj, imcon, natoms, nframes, nrecords
+       keytrj, imcon, natoms = [int(x) for x in lines[1].split()[:3]]
+       # Every frame has a timestep line, the cell (if there is one) and 2+keytrj lines for each atom
+       hascell = 1 if imcon>0 else 0
+       framelen = 1 + 3*hascell + natoms*(2+keytrj)
+       nframes = int( (len(lines)-2) / framelen )
+       # This is the index with the line on which each frame starts
+       offsets = 2 + framelen*np.arange(nframes)
+       for i in offsets :
+           if not lines[i].startswith("timestep") : raise Exception("found invalid HISTORY file")
+       frames = np.array( lines[2:2+nframes*framelen], dtype=object ).reshape([nframes,framelen])
+       atoms = frames[:,1+3*hascell:].reshape([nframes,natoms,2+keytrj])
+       pos = np.loadtxt( atoms[:,:,1].ravel(), ndmin=2 ).reshape([nframes,natoms,3])
+       # Atoms are sorted by their index if they are not in order
+       ids = np.loadtxt( atoms[:,:,0].ravel(), usecols=1, dtype=int, ndmin=1 ).reshape([nframes,natoms])
+       if np.any( ids!=np.arange(1,natoms+1) ) : pos = np.take_along_axis( pos, np.argsort(ids,axis=1)[:,:,np.newaxis], axis=1 )
+       cell = np.zeros([nframes,9])
+       if hascell :
+           vectors = np.loadtxt( frames[:,1:4].ravel(), ndmin=2 ).reshape([nframes,3,3])
+           cell[:,[0,4,8]] = 0.1*np.linalg.norm( vectors, axis=2 )
+       data = { "natoms": [natoms]*nframes, "positions": 0.1*pos.reshape([-1,3]), "cell": cell }
+       self._historycache[fname] = ( mtime, data )
+       return data
+
    def getNumberOfAtoms( self, rundir ) :
-       natoms, traj = [], mda.coordinates.DLPoly.HistoryReader( rundir + "/HISTORY" )
-       for frame in traj.trajectory : natoms.append( frame.positions.shape[0] ) 
-       return natoms 
+       return self._readHistory( rundir )["natoms"]
 
    def getPositions( self, rundir ) :
-       first, traj = True, mda.coordinates.DLPoly.HistoryReader( rundir + "/HISTORY" )
-       for frame in traj.trajectory :
-          if first : pos, first = 0.1*frame.positions.copy(), False
-          else : pos = np.concatenate( (pos, 0.1*frame.positions), axis=0 ) 
-       return pos
+       return self._readHistory( rundir )["positions"]
 
    def getCell( self, rundir ) :
-       traj = mda.coordinates.DLPoly.HistoryReader( rundir + "/HISTORY" )
-       cell = np.zeros( [len(traj.trajectory),9] )
-       for i, frame in enumerate(traj.trajectory) : 
-           cell[i,0], cell[i,4], cell[i,8] = 0.1*frame.dimensions[0], 0.1*frame.dimensions[1], 0.1*frame.dimensions[2]
-       return cell
+       return self._readHistory( rundir )["cell"]
 
    def getMasses( self, rundir ) :
        masses = np.zeros(4*64)
@@ -108,10 +140,13 @@ traj_interval         1 steps
 
    def getEnergy( self, rundir ) :
        f = open( rundir + "/STATIS", "r")
-       statisdata = f.readlines()
+       # skip the two header lines
+       f.readline()
+       f.readline()
+       statisdata = np.fromstring( f.read(), sep=" " )
        f.close()
-       nframes = int( (len(statisdata)-2) / 11 )
-       energy = []
-       for i in range(nframes) :
-           energy.append( 1E-2*float(statisdata[2+i*11 + 1].split()[2]) )
-       return energy
+       # Each record is nstep, time, the number of entries and then the entries
+       # The configurational energy is the third entry
+       reclen = 3 + int( statisdata[2] )
+       nframes = int( len(statisdata) / reclen )
+       return 1E-2*statisdata[:nframes*reclen].reshape([nframes,reclen])[:,5]
@@ -35,11 +35,10 @@ if [ -x "${prefix}/bin/gmx" ]; then
    executible=$HOME/opt/bin/gromacs$exeSuffix
    cat <<EOF >"$executible"
 #!/bin/bash
-export PLUMED_KERNEL=$plumedKernel
+export PLUMED_KERNEL=\${PLUMED_KERNEL:-$plumedKernel}
 mygmx=$prefix/bin/gmx
 "\$mygmx" grompp -p topol.top -c conf.gro -f md.mdp
 "\$mygmx" mdrun -nt 1 -plumed plumed.dat
-echo 5 | "\$mygmx" energy
 EOF
    chmod u+x "$executible"
 else
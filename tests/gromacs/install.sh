@@ -34,11 +34,11 @@ if [ -x "${prefix}/bin/gmx_mpi" ]; then
    executible=$HOME/opt/bin/gromacs$exeSuffix
    cat <<EOF >"$executible"
 #!/bin/bash
-export PLUMED_KERNEL=$plumedKernel
+export PLUMED_KERNEL=\${PLUMED_KERNEL:-$plumedKernel}
 mygmx=$prefix/bin/gmx_mpi
 "\$mygmx" grompp -p topol.top -c conf.gro -f md.mdp
-"\$mygmx" mdrun -plumed plumed.dat
-echo 5 | "\$mygmx" energy
+# MDRUN_LAUNCHER (e.g. "mpirun -np 4") is set by the harness to run mdrun on more ranks
+\${MDRUN_LAUNCHER} "\$mygmx" mdrun -plumed plumed.dat "\$@"
 EOF
    chmod u+x "$executible"
 else
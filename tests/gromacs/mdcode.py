@@ -3,10 +3,16 @@ import time
 import numpy as np
 import MDAnalysis as mda
 import subprocess
+from mdhelper import launchCommand, readEdr, readPerformance
 
 class mdcode :
+   # the code is run on mdparams["mpiranks"] MPI ranks, for the scaling with --ranks
+   withMPI = True
+
    def __init__( self ) :
        AngToNm = 0.1
+       # cache of the data read from traj_comp.xtc, keyed by file name
+       self._xtccache = {}
 
    def setParams( self ) :
        params = {
@@ -63,39 +69,47 @@ ref-t                    = {mdparams["temperature"]}
        of.close()
        # Work out the script that will run ipi for us
        executible = mdparams["executible"] 
+       # The extra arguments are passed to mdrun by the script
+       cmd = [executible]
+       if "nthreads" in mdparams : cmd = cmd + ["-ntomp", str(mdparams["nthreads"])]
+       # gmx_mpi has no thread-MPI: the script starts only mdrun with the MPI launcher
+       env = dict( os.environ, MDRUN_LAUNCHER=" ".join( launchCommand([], mdparams) ) )
        # Now run the calculation using subprocess
        with open("stdout","w") as stdout:
         with open("stderr","w") as stderr:
-           out = subprocess.run([executible], text=True, input=inp, stdout=stdout, stderr=stderr )
+           out = subprocess.run(cmd, text=True, input=inp, stdout=stdout, stderr=stderr, env=env )
        return out.returncode
 
+   def getPerformance( self, rundir ) :
+       # the ns/day at the end of md.log
+       return readPerformance( rundir + "/md.log" )
+
    def getTimestep( self ) :
        return 0.002
 
+   def _readXTC( self, rundir ) :
+       fname = rundir + "/traj_comp.xtc"
+       mtime = os.path.getmtime( fname )
+       if fname in self._xtccache and self._xtccache[fname][0]==mtime : return self._xtccache[fname][1]
+       # Read all the frames in one pass into preallocated arrays (xtc files are in nm)
+       with mda.coordinates.XTC.XTCFile( fname ) as xtc :
+         nframes, natoms = len(xtc), xtc.n_atoms
+         pos, box = np.zeros([nframes,natoms,3],dtype=np.float32), np.zeros([nframes,3,3])
+         for i, frame in enumerate(xtc) : pos[i], box[i] = frame.x, frame.box
+       cell = np.zeros([nframes,9])
+       cell[:,[0,4,8]] = np.linalg.norm( box, axis=2 )
+       data = { "natoms": [natoms]*nframes, "positions": pos.reshape([-1,3]), "cell": cell }
+       self._xtccache[fname] = ( mtime, data )
+       return data
+
    def getNumberOfAtoms( self, rundir ) :
-       natoms = [] 
-       with mda.coordinates.XTC.XTCFile( rundir + "/traj_comp.xtc") as xtc : 
-         for frame in xtc : natoms.append( xtc.n_atoms )
-       return natoms
+       return self._readXTC( rundir )["natoms"]
        
    def getPositions( self, rundir ) :
-       fnum = 0
-       with mda.coordinates.XTC.XTCFile( rundir + "/traj_comp.xtc") as xtc :
-         for frame in xtc :
-             if fnum==0 : pos = frame.x
-             else : pos = np.concatenate( (pos, frame.x), axis=0 )
-             fnum = fnum + 1
-       return pos
+       return self._readXTC( rundir )["positions"]
 
    def getCell( self, rundir ) :
-       first, traj = True, mda.coordinates.XTC.XTCReader( rundir + "/traj_comp.xtc") 
-       for frame in traj : 
-           dim = frame.dimensions
-           if first : first, cell = False, np.array( [[dim[0]/10,0,0,0,dim[1]/10,0,0,0,dim[2]/10]] )
-           else :
-              box = np.array( [[dim[0]/10,0,0,0,dim[1]/10,0,0,0,dim[2]/10]] )
-              cell = np.concatenate( (cell, box), axis=0 )  
-       return cell
+       return self._readXTC( rundir )["cell"]
 
    def getMasses( self, rundir ) :
        natoms = self.getNumberOfAtoms( rundir )
@@ -120,5 +134,4 @@ ref-t                    = {mdparams["temperature"]}
        return charges
   
    def getEnergy( self, rundir ) :
-       eng = np.loadtxt( rundir + "/energy.xvg", comments=["#","@"] )
-       return eng[:,1]
+       return readEdr( rundir + "/ener.edr", ["Potential"] )["Potential"]
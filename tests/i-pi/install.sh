@@ -31,9 +31,25 @@ executable=$HOME/opt/bin/i-pi
 cat <<EOF >"$executable"
 #!/bin/bash
 #export PYTHONPATH=$HOME/opt/lib/plumed$suffix/python
-export PLUMED_KERNEL=$plumedKernel
+export PLUMED_KERNEL=\${PLUMED_KERNEL:-$plumedKernel}
 ipibin=$HOME/opt/i-pi/bin
-\${ipibin}/i-pi input.xml & sleep 5
-\${ipibin}/i-pi-driver -m sg -h localhost -o 15 -p 31415
+# the socket is chosen by the test harness: mode (unix or inet), address and port
+mode=\${1:-inet}
+address=\${2:-localhost}
+port=\${3:-31415}
+\${ipibin}/i-pi input.xml &
+if [[ \$mode = unix ]]; then
+   # wait for i-pi to create the socket (at most 30 seconds)
+   for _ in \$(seq 300); do
+      [[ -S /tmp/ipi_\$address ]] && break
+      sleep 0.1
+   done
+   \${ipibin}/i-pi-driver -m sg -u -h "\$address" -o 15
+else
+   sleep 5
+   \${ipibin}/i-pi-driver -m sg -h "\$address" -o 15 -p "\$port"
+fi
+# do not return before the i-pi server has finished
+wait
 EOF
 chmod u+x "$executable"
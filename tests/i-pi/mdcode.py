@@ -1,8 +1,8 @@
 import os
-import time
 import numpy as np
 import MDAnalysis as mda
 import subprocess
+from mdhelper import plumedOutputFiles, waitForOutputs, getFreePort, uniqueSocketName
 
 class mdcode :
    def __init__( self ) :
@@ -30,9 +30,12 @@ class mdcode :
        inp = inp + "  <prng>\n"
        inp = inp + "    <seed>32342</seed>\n"
        inp = inp + "  </prng>\n"
-       inp = inp + "  <ffsocket mode='inet' name='driver'>\n"
-       inp = inp + "    <address>localhost</address>\n"
-       inp = inp + "    <port> 31415 </port>\n"
+       # Each run gets its own socket so that many i-pi calculations can run at the same time
+       if mdparams.get("socket","unix")=="inet" : mode, address, port = "inet", "localhost", getFreePort()
+       else : mode, address, port = "unix", uniqueSocketName( os.getcwd() ), 0
+       inp = inp + "  <ffsocket mode='" + mode + "' name='driver'>\n"
+       inp = inp + "    <address>" + address + "</address>\n"
+       if mode=="inet" : inp = inp + "    <port> " + str(port) + " </port>\n"
        inp = inp + "  </ffsocket>\n"
        inp = inp + "  <ffplumed name='plumed'>\n"
        inp = inp + "   <file mode='xyz'> structure.xyz </file>\n"
@@ -82,9 +85,16 @@ class mdcode :
        # Now run the calculation using subprocess
        with open("stdout","w") as stdout:
         with open("stderr","w") as stderr:
-           out = subprocess.run([executible], text=True, input=inp, stdout=stdout, stderr=stderr )
-       # Just pause for a second after run to make sure there is time to write out all files
-       time.sleep(5)
+           out = subprocess.run([executible, mode, address, str(port)], text=True, input=inp, stdout=stdout, stderr=stderr )
+       # i-pi may still be writing when the driver returns so wait until all the outputs are complete
+       if out.returncode==0 :
+          with open("structure.xyz","r") as f : natoms = int( f.readline() )
+          # i-pi outputs the initial configuration too and the xyz comment lines start with #
+          nframes = mdparams["nsteps"] + 1
+          expected = { "tut1.pos_0.xyz": nframes*(natoms+1), "tut1.md": nframes }
+          for fname in plumedOutputFiles( mdparams["plumed"] ) : expected[fname] = None
+          # the outputs that are not complete must not be compared
+          if not waitForOutputs( expected ) : return 1
        return out.returncode
 
    def getTimestep( self ) :
@@ -1,8 +1,18 @@
+import os
 import numpy as np
-import MDAnalysis as mda
 import subprocess
+from mdhelper import launchCommand, readPerformance
 
 class mdcode :
+   # the code can be run with mdparams["plumed"] set to None, for the benchmark
+   withoutPlumed = True
+   # the code is run on mdparams["mpiranks"] MPI ranks, for the scaling with --ranks
+   withMPI = True
+
+   def __init__( self ) :
+       # cache of the trajectories read from lammps.xyz, keyed by file name
+       self._xyzcache = {}
+
    def setParams( self ) :
        params = {
          "temperature": 275,
@@ -32,12 +42,13 @@ class mdcode :
        inp = inp + "group           two id 80 82 83 84\n"
        inp = inp + "group           ref id 37\n"
        inp = inp + "group           colvar union one two ref\n"
-       inp = inp + "fix             2 all plumed plumedfile plumed.dat outfile p.log\n"
+       if mdparams["plumed"] is not None : inp = inp + "fix             2 all plumed plumedfile plumed.dat outfile p.log\n"
        if mdparams["ensemble"]=="nvt" : inp = inp + "fix             1 all nvt temp  " + str(mdparams["temperature"]) + " " + str(mdparams["temperature"]) + " " + str(mdparams["relaxtime"]) + " tchain 1\n"
        elif mdparams["ensemble"]=="npt" : inp = inp + "fix           1 all npt temp  " + str(mdparams["temperature"]) + " " + str(mdparams["temperature"]) + " " + str(mdparams["relaxtime"]) + " iso " + str(mdparams["pressure"]) + " " + str(mdparams["pressure"]) + " " + str(mdparams["prelaxtime"]) + " tchain 1 \n"
        # Code to deal with restraint 
        if "restraint" in mdparams and mdparams["restraint"]>0 : inp = inp + "fix 6 all restrain bond 1 2 10.0 10.0 " + str(10*mdparams["restraint"]) + "\n"
-       inp = inp + "thermo_style    custom step temp etotal pe ke epair ebond f_2\n"
+       if mdparams["plumed"] is not None : inp = inp + "thermo_style    custom step temp etotal pe ke epair ebond f_2\n"
+       else : inp = inp + "thermo_style    custom step temp etotal pe ke epair ebond\n"
        inp = inp + "thermo          10\n"
        inp = inp + "dump            dd all xyz 1 lammps.xyz\n"
        inp = inp + "variable        step equal step\n"
@@ -58,41 +69,57 @@ class mdcode :
        # Now run the calculation using subprocess
        with open("stdout","w") as stdout:
         with open("stderr","w") as stderr:
-          out = subprocess.run([executible], text=True, input=inp, stdout=stdout, stderr=stderr )
+          out = subprocess.run(launchCommand([executible], mdparams), text=True, input=inp, stdout=stdout, stderr=stderr )
        return out.returncode
 
+   def getPerformance( self, rundir ) :
+       # LAMMPS prints the ns/day at the end of the run
+       return readPerformance( rundir + "/stdout" )
+
    def getTimestep( self ) :
        return 0.00025
 
+   def _readXYZ( self, rundir ) :
+       fname = rundir + "/lammps.xyz"
+       mtime = os.path.getmtime( fname )
+       if fname in self._xyzcache and self._xyzcache[fname][0]==mtime : return self._xyzcache[fname][1]
+       f = open( fname, "r" )
+       lines = f.read().splitlines()
+       f.close()
+       # Every frame is made of natoms lines preceded by two header lines
+       natoms = int( lines[0] )
+       nframes = int( len(lines) / (natoms+2) )
+       if len(lines)%(natoms+2)!=0 : raise Exception("found invalid xyz file")
+       atomlines = np.array( lines, dtype=object ).reshape([nframes,natoms+2])[:,2:].ravel()
+       pos = np.loadtxt( atomlines, usecols=(1,2,3), ndmin=2 ) / 10
+       self._xyzcache[fname] = ( mtime, (natoms, nframes, pos) )
+       return natoms, nframes, pos
+
    def getNumberOfAtoms( self, rundir ) :
-       natoms, traj = [], mda.coordinates.XYZ.XYZReader( rundir + "/lammps.xyz")
-       for frame in traj.trajectory : natoms.append( frame.positions.shape[0] )
-       return natoms
+       natoms, nframes, pos = self._readXYZ( rundir )
+       return [natoms]*nframes
 
    def getPositions( self, rundir ) :
-       first, traj = True, mda.coordinates.XYZ.XYZReader( rundir + "/lammps.xyz")
-       for frame in traj.trajectory :
-          if first : pos, first = frame.positions / 10, False
-          else : pos = np.concatenate( (pos, frame.positions / 10), axis=0 )
+       natoms, nframes, pos = self._readXYZ( rundir )
        return pos
 
    def getMassCharge(self, rundir, col) :
-       data = np.zeros( self.getNumberOfAtoms(rundir)[0] )
        f = open( rundir + "/mq_lammps", "r")
-       inp, inmasses = f.read(), False
+       lines = f.read().splitlines()
        f.close()
-       for line in inp.splitlines() :
-           if inmasses :
-              words = line.split()
-              data[int(words[0])-1] = float(words[col])
-           elif "ATOMS id mass q" in line : inmasses = True
-           
+       # The first frame of the dump is: ITEM: TIMESTEP (2 lines), ITEM: NUMBER OF ATOMS (2 lines),
+       # ITEM: BOX BOUNDS (4 lines) and ITEM: ATOMS id mass q followed by one line per atom
+       natoms, first = int( lines[3] ), 9
+       if "ATOMS id mass q" not in lines[first-1] : raise Exception("found invalid mq_lammps file")
+       block = np.loadtxt( lines[first:first+natoms], ndmin=2 )
+       data = np.zeros( natoms )
+       data[block[:,0].astype(int)-1] = block[:,col]
        return data
 
    def getCell( self, rundir ) :
-       cell_size = np.loadtxt( rundir + "/lammps_cell")
+       cell_size = np.loadtxt( rundir + "/lammps_cell", ndmin=2 )
        cell_final = np.zeros([cell_size.shape[0],9])
-       for i in range(cell_size.shape[0]) : cell_final[i,0], cell_final[i,4], cell_final[i,8] = cell_size[i,0]/10, cell_size[i,1]/10, cell_size[i,2]/10
+       cell_final[:,[0,4,8]] = cell_size[:,:3] / 10
        return cell_final 
 
    def getMasses( self, rundir ) :
@@ -102,4 +129,4 @@ class mdcode :
        return self.getMassCharge( rundir, 2 ) 
 
    def getEnergy( self, rundir ) :
-       return  np.loadtxt(rundir + "/lammps_energy")[:,1]*4.184 
+       return  np.loadtxt(rundir + "/lammps_energy", usecols=1)*4.184 
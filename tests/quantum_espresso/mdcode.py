@@ -2,6 +2,7 @@ import os
 import numpy as np
 import xml.etree.ElementTree as ET
 import subprocess
+from mdhelper import launchCommand
 
 # QE output units:
 # xml: Hartrees
@@ -12,10 +13,17 @@ import subprocess
 
 
 class mdcode:
+    # the code can be run with mdparams["plumed"] set to None, for the benchmark
+    withoutPlumed = True
+    # the code is run on mdparams["mpiranks"] MPI ranks, for the scaling with --ranks
+    withMPI = True
+
     def __init__(self):
         self.bohrToNm = 0.0529177249
         # The output in the xml file is in Hartrees and not Rydbergs
         self.HaToKJ = 2 * 1312.75
+        # cache of the data read from pwscf.xml, keyed by file name
+        self._xmlcache = {}
 
     def setParams(self):
         params = {
@@ -76,11 +84,14 @@ class mdcode:
         )
         # Work out the name of the espresso executable
         executible = mdparams["executible"]
+        cmd = [executible]
+        if mdparams["plumed"] is not None:
+            cmd = cmd + ["-plumed"]
         # Now run the calculation using subprocess
         with open("stdout", "w") as stdout:
             with open("stderr", "w") as stderr:
                 out = subprocess.run(
-                    [executible, "-plumed"],
+                    launchCommand(cmd, mdparams),
                     text=True,
                     input=inp,
                     stdout=stdout,
@@ -91,80 +102,94 @@ class mdcode:
     def getTimestep(self):
         return 20 * 4.8378e-5
 
+    def _readXML(self, rundir):
+        """Read pwscf.xml in a single streaming pass.
+
+        All the per-step quantities are collected together and cached,
+        so the getters below do not parse the file again.
+        The positions and cells are stored in arrays that are preallocated
+        using nstep and nat from the input section of the file.
+        """
+        fname = rundir + "/pwscf.xml"
+        mtime = os.path.getmtime(fname)
+        if fname in self._xmlcache and self._xmlcache[fname][0] == mtime:
+            return self._xmlcache[fname][1]
+
+        natoms, pos, cell, energies, masses = [], None, None, [], []
+        nframes, depth, root = 0, 0, None
+        for event, elem in ET.iterparse(fname, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                depth = depth + 1
+                continue
+            depth = depth - 1
+            # we only look at the direct children of the root element
+            if depth != 1:
+                continue
+            if elem.tag == "input":
+                species = {}
+                for spec in elem.find("atomic_species").findall("species"):
+                    species[spec.attrib["name"]] = float(spec.find("mass").text)
+                struct = elem.find("atomic_structure")
+                masses = [
+                    species[atom.attrib["name"]]
+                    for atom in struct.find("atomic_positions").findall("atom")
+                ]
+                nat = int(struct.attrib["nat"])
+                nstep = elem.find("control_variables").find("nstep")
+                # there is one step element for each MD step (plus a spare)
+                capacity = 1 if nstep is None else int(nstep.text) + 1
+                pos = np.zeros([capacity, nat, 3])
+                cell = np.zeros([capacity, 9])
+            elif elem.tag == "step":
+                struct = elem.find("atomic_structure")
+                nat = int(struct.attrib["nat"])
+                if pos is None:
+                    pos, cell = np.zeros([1, nat, 3]), np.zeros([1, 9])
+                elif nframes == pos.shape[0]:
+                    # more steps than expected from the input, so we grow the arrays
+                    pos = np.resize(pos, [2 * nframes, nat, 3])
+                    cell = np.resize(cell, [2 * nframes, 9])
+                natoms.append(nat)
+                apos = " ".join(
+                    atom.text
+                    for atom in struct.find("atomic_positions").findall("atom")
+                )
+                pos[nframes] = np.fromstring(apos, sep=" ").reshape([nat, 3])
+                cellf = struct.find("cell")
+                acell = " ".join(cellf.find(a).text for a in ("a1", "a2", "a3"))
+                cell[nframes] = np.fromstring(acell, sep=" ")
+                energies.append(float(elem.find("total_energy").find("etot").text))
+                nframes = nframes + 1
+            # free the element (and everything that was read before it)
+            root.clear()
+
+        data = {
+            "natoms": natoms,
+            "positions": self.bohrToNm * pos[:nframes].reshape([-1, 3]),
+            "cell": self.bohrToNm * cell[:nframes],
+            "energy": self.HaToKJ * np.array(energies),
+            "masses": masses,
+        }
+        self._xmlcache[fname] = (mtime, data)
+        return data
+
     def getNumberOfAtoms(self, rundir):
-        natoms, root = [], ET.parse(rundir + "/pwscf.xml")
-        for step in root.findall("step"):
-            adict = step.find("atomic_structure").attrib
-            natoms.append(int(adict["nat"]))
-        return natoms
+        return self._readXML(rundir)["natoms"]
 
     def getPositions(self, rundir):
-        natoms = self.getNumberOfAtoms(rundir)
-        pos = np.zeros([sum(natoms), 3])
-
-        n, root = 0, ET.parse(rundir + "/pwscf.xml")
-        for step in root.findall("step"):
-            struct = step.find("atomic_structure")
-            apos = struct.find("atomic_positions")
-            allatoms = apos.findall("atom")
-            for atom in allatoms:
-                strpos = atom.text.split()
-                pos[n][0], pos[n][1], pos[n][2] = (
-                    self.bohrToNm * float(strpos[0]),
-                    self.bohrToNm * float(strpos[1]),
-                    self.bohrToNm * float(strpos[2]),
-                )
-                n = n + 1
-        return pos
+        return self._readXML(rundir)["positions"]
 
     def getCell(self, rundir):
-        natoms = self.getNumberOfAtoms(rundir)
-        cell = np.zeros([len(natoms), 9])
-        n, root = 0, ET.parse(rundir + "/pwscf.xml")
-        for step in root.findall("step"):
-            struct = step.find("atomic_structure")
-            cellf = struct.find("cell")
-            astr = cellf.find("a1").text.split()
-            cell[n][0], cell[n][1], cell[n][2] = (
-                self.bohrToNm * float(astr[0]),
-                self.bohrToNm * float(astr[1]),
-                self.bohrToNm * float(astr[2]),
-            )
-            astr = cellf.find("a2").text.split()
-            cell[n][3], cell[n][4], cell[n][5] = (
-                self.bohrToNm * float(astr[0]),
-                self.bohrToNm * float(astr[1]),
-                self.bohrToNm * float(astr[2]),
-            )
-            astr = cellf.find("a3").text.split()
-            cell[n][6], cell[n][7], cell[n][8] = (
-                self.bohrToNm * float(astr[0]),
-                self.bohrToNm * float(astr[1]),
-                self.bohrToNm * float(astr[2]),
-            )
-            n = n + 1
-        return cell
+        return self._readXML(rundir)["cell"]
 
     def getMasses(self, rundir):
-        root = ET.parse(rundir + "/pwscf.xml")
-        species, inpt = {}, root.find("input")
-        for spec in inpt.find("atomic_species").findall("species"):
-            species[spec.attrib["name"]] = float(spec.find("mass").text)
-
-        masses = []
-        for atom in (
-            inpt.find("atomic_structure").find("atomic_positions").findall("atom")
-        ):
-            masses.append(species[atom.attrib["name"]])
-        return masses
+        return self._readXML(rundir)["masses"]
 
     def getCharges(self, rundir):
         natoms = self.getNumberOfAtoms(rundir)
         return np.zeros(natoms[0])
 
     def getEnergy(self, rundir):
-        energies, root = [], ET.parse(rundir + "/pwscf.xml")
-        for step in root.findall("step"):
-            ebrac = step.find("total_energy")
-            energies.append(self.HaToKJ * float(ebrac.find("etot").text))
-        return energies
+        return self._readXML(rundir)["energy"]
@@ -0,0 +1,41 @@
+import sys
+import subprocess
+from backends import measuredRunMD
+
+MB = 2**20
+
+
+class commandRunner:
+    """Runs the command in the parameters as the MD code"""
+
+    def runMD(self, mdparams):
+        return subprocess.run(mdparams["command"]).returncode
+
+
+def touched(size):
+    """Returns a buffer of size bytes, with all its pages resident"""
+    buffer = bytearray(size)
+    buffer[::4096] = b"1" * len(buffer[::4096])
+    return buffer
+
+
+def test_peakRSS_excludes_the_harness():
+    harness = touched(300 * MB)
+    exitcode, usage = measuredRunMD(commandRunner(), {"command": ["sleep", "0.3"]})
+    assert exitcode == 0
+    assert usage["maxrss"] < 50 * MB
+    del harness
+
+
+def test_peakRSS_of_the_calculation():
+    command = [
+        sys.executable,
+        "-c",
+        "import time\n"
+        "x = bytearray(200 * 2**20)\n"
+        "x[::4096] = b'1' * len(x[::4096])\n"
+        "time.sleep(0.3)\n",
+    ]
+    exitcode, usage = measuredRunMD(commandRunner(), {"command": command})
+    assert exitcode == 0
+    assert usage["maxrss"] > 150 * MB
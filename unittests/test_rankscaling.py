@@ -0,0 +1,83 @@
+import os
+import numpy as np
+from runtests import runRankScaling
+from runhelper import formatFailureRate
+
+NATOMS = 4
+
+
+class fakeMPIcode:
+    """A code that writes the same positions as PLUMED, on any number of ranks"""
+
+    withMPI = True
+
+    def setParams(self):
+        return {"temperature": 1.0, "tstep": 0.005, "relaxtime": 1.0}
+
+    def _positions(self, nsteps):
+        rng = np.random.default_rng(0)
+        return rng.uniform(0, 2.0, (nsteps + 1, NATOMS, 3))
+
+    def runMD(self, mdparams):
+        # runMD is called in a child process, so the ranks are written in the run
+        with open("ranks", "w") as f:
+            f.write(str(mdparams.get("mpiranks", 1)))
+        pos = self._positions(mdparams["nsteps"])
+        np.save("positions.npy", pos)
+        with open("plumed.xyz", "w") as f:
+            for frame in pos:
+                f.write(f"{NATOMS}\n 2.0 2.0 2.0\n")
+                for x, y, z in frame:
+                    f.write(f"X {x:.6f} {y:.6f} {z:.6f}\n")
+        with open("cell_data", "w") as f:
+            f.write(
+                "#! FIELDS time " + " ".join(f"c.{v}{x}" for v in "abc" for x in "xyz")
+            )
+            f.write("\n")
+            for i in range(len(pos)):
+                f.write(f"{i} 2 0 0 0 2 0 0 0 2\n")
+        return 0
+
+    def getNumberOfAtoms(self, rundir):
+        return [NATOMS] * len(np.load(f"{rundir}/positions.npy"))
+
+    def getPositions(self, rundir):
+        return np.load(f"{rundir}/positions.npy").reshape(-1, 3)
+
+    def getCell(self, rundir):
+        cell = np.zeros([len(np.load(f"{rundir}/positions.npy")), 9])
+        cell[:, [0, 4, 8]] = 2.0
+        return cell
+
+
+def test_rankScalingRunsTheExecutableOfTheVersion(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("tests/fakempi/input")
+    # only the executable of the version exists, not one for each number of ranks
+    os.makedirs("bin")
+    with open("bin/fakempi_v2.10", "w") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod("bin/fakempi_v2.10", 0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}/bin:{os.environ['PATH']}")
+    runner = fakeMPIcode()
+    info = {
+        "positions": True,
+        "timestep": False,
+        "mass": False,
+        "charge": False,
+        "forces": False,
+    }
+    settings = dict(
+        code="fakempi",
+        version="v2.10",
+        runner=runner,
+        executible="fakempi",
+        makeArchive=False,
+        usage={},
+    )
+    scaling = runRankScaling("tests/fakempi", info, settings, 0.001, [2, 4])
+    for nranks in (2, 4):
+        with open(f"tests/fakempi/basic_v2.10_np{nranks}/ranks") as f:
+            assert int(f.read()) == nranks
+        rate = scaling[nranks]["failure_rate"]["positions"]
+        assert formatFailureRate(rate) != "brk"